@@ -0,0 +1,102 @@
+# coding=utf-8
+"""
+Benchmark the CAN transports: latency of small control messages, throughput of camera frames.
+
+Usage (from the project root):
+    PYTHONPATH=src python3 -m applications.can_benchmark --transports tcp ipc inproc local --count 500
+"""
+import argparse
+import logging
+import time
+from threading import Thread, Event
+import numpy as np
+from components import ZmqCAN, LocalCAN
+
+
+class _Receiver:
+    def __init__(self):
+        self.count = 0
+        self.latencies = []
+        self.arrived = Event()
+
+    def on_message(self, channel, message):
+        if channel == 'bench/latency':
+            self.latencies.append(time.perf_counter() - message)
+        self.count += 1
+        self.arrived.set()
+
+
+def _start_bus(transport: str, port: int, stop_event):
+    if transport == 'local':
+        can = LocalCAN()
+    else:
+        server = ZmqCAN(True, transport=transport, port=port, capture=False)
+        Thread(target=server.run, args=(stop_event,), daemon=True).start()
+        can = ZmqCAN(False, transport=transport, port=port)
+    Thread(target=can.run, args=(stop_event,), daemon=True).start()
+    return can
+
+
+def benchmark(transport: str, count: int = 500, frame_shape: tuple = (360, 640, 3), port: int = 6100) -> dict:
+    """
+    Returns:
+        dict of latency percentiles (ms) and throughput (frames per second, MB per second)
+    """
+    stop_event = Event()
+    can = _start_bus(transport, port, stop_event)
+    receiver = _Receiver()
+    can.subscribe(['bench/latency', 'bench/frame'], receiver.on_message)
+    time.sleep(0.5)  # let the subscription reach the broker
+
+    # latency, one message at a time
+    for i in range(count):
+        receiver.arrived.clear()
+        can.publish('bench/latency', time.perf_counter())
+        receiver.arrived.wait(1.0)
+    latencies = np.array(receiver.latencies) * 1000
+
+    # throughput, frames as fast as possible
+    frame = np.random.randint(0, 255, frame_shape, dtype=np.uint8)
+    receiver.count = 0
+    start = time.perf_counter()
+    for i in range(count):
+        can.publish('bench/frame', frame)
+    while receiver.count < count and time.perf_counter() - start < 30:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    stop_event.set()
+    can.shutdown()
+    time.sleep(0.1)
+    return {
+        'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) > 0 else float('nan'),
+        'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) > 0 else float('nan'),
+        'frames_per_second': receiver.count / elapsed,
+        'mb_per_second': receiver.count * frame.nbytes / elapsed / 1e6,
+        'frames_lost': count - receiver.count,
+    }
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s:%(name)s:%(levelname)s: %(message)s', level=logging.WARNING)
+    parser = argparse.ArgumentParser(description='CAN transport benchmark.')
+    parser.add_argument('--transports', nargs='+', default=['tcp', 'ipc', 'inproc', 'local'])
+    parser.add_argument('--count', type=int, default=500, help='number of messages per test')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=360)
+    args = parser.parse_args()
+
+    print('{:<8} {:>10} {:>10} {:>10} {:>10} {:>6}'.format('transport', 'p50(ms)', 'p99(ms)', 'frames/s', 'MB/s',
+                                                           'lost'))
+    for i, transport in enumerate(args.transports):
+        result = benchmark(transport, args.count, (args.height, args.width, 3), port=6100 + i * 10)
+        print('{:<8} {:>10.3f} {:>10.3f} {:>10.1f} {:>10.1f} {:>6}'.format(transport,
+                                                                           result['latency_p50_ms'],
+                                                                           result['latency_p99_ms'],
+                                                                           result['frames_per_second'],
+                                                                           result['mb_per_second'],
+                                                                           result['frames_lost']))
+
+
+if __name__ == '__main__':
+    main()
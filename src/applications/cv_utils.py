@@ -3,6 +3,8 @@ import cv2
 import numpy as np
 import pickle
 import logging
+import hashlib
+import os
 
 
 def calibrate_camera(chessboard_input_images: list, chessboard_corners=(9, 6), debug=False):
@@ -87,7 +89,16 @@ def undistort_and_tansform(image, mtx, dist, calibrate_corners, calibrate_image_
     Do undistortion and then use the chessboard outer 4 corners to do perspective transform.
     """
     undistorted = undistort(image, mtx, dist)
+    src, dst = _birds_view_points(mtx, dist, calibrate_corners, calibrate_image_size, dst_size, chessboard_corners)
+    transformed = perspective_transform(undistorted, src, dst, dst_size)
+    return transformed
 
+
+def _birds_view_points(mtx, dist, calibrate_corners, calibrate_image_size, dst_size: tuple = None,
+                       chessboard_corners=(9, 6)) -> tuple:
+    """
+    Source (undistorted image) and destination (bird's view) points of the perspective transform.
+    """
     # For source points I'm grabbing the outer four detected corners
     nx, ny = chessboard_corners
     # top left, top right, bottom right, bottom left
@@ -105,9 +116,76 @@ def undistort_and_tansform(image, mtx, dist, calibrate_corners, calibrate_image_
     if dst_size is not None:
         height_increment = dst_size[1] - calibrate_image_size[1]
         dst[:, 1] += height_increment  # move the dst points down to show more
+    return src, dst
 
-    transformed = perspective_transform(undistorted, src, dst, dst_size)
-    return transformed
+
+def undistort_and_transform_maps(mtx, dist, calibrate_corners, calibrate_image_size, image_size: tuple,
+                                 dst_size: tuple = None, chessboard_corners=(9, 6)) -> tuple:
+    """
+    Remap tables doing 'undistort_and_tansform' in one 'cv2.remap' pass:
+    each output pixel is mapped back through the inverse perspective transform,
+    then through the lens distortion, to its position in the captured image.
+
+    Args:
+        image_size: (width, height) of the captured images.
+
+    Returns:
+        map1, map2 for 'cv2.remap' (fixed point, CV_16SC2)
+    """
+    src, dst = _birds_view_points(mtx, dist, calibrate_corners, calibrate_image_size, dst_size, chessboard_corners)
+    m_inv = np.linalg.inv(cv2.getPerspectiveTransform(src, dst))
+    width, height = dst_size if dst_size is not None else image_size
+
+    v, u = np.mgrid[0:height, 0:width]
+    pixels = np.stack([u.ravel(), v.ravel(), np.ones(u.size)]).astype(np.float64)
+    undistorted = m_inv @ pixels
+    horizon = np.abs(undistorted[2]) < 1e-12
+    undistorted /= np.where(horizon, 1, undistorted[2])
+    # back to normalized camera coordinates, then project with the lens distortion
+    normalized = np.linalg.inv(mtx) @ undistorted
+    distorted, _ = cv2.projectPoints(normalized.T.reshape(-1, 1, 3), np.zeros(3), np.zeros(3), mtx, dist)
+    distorted = distorted.reshape(height, width, 2)
+    distorted[horizon.reshape(height, width)] = -1
+    # out of the image, and in the fixed point range
+    np.clip(distorted[..., 0], -1, image_size[0], out=distorted[..., 0])
+    np.clip(distorted[..., 1], -1, image_size[1], out=distorted[..., 1])
+    return cv2.convertMaps(distorted[..., 0].astype(np.float32), distorted[..., 1].astype(np.float32),
+                           cv2.CV_16SC2)
+
+
+def load_undistort_and_transform_maps(calibration_result: str, image_size: tuple, dst_size: tuple = None) -> tuple:
+    """
+    The remap tables ('undistort_and_transform_maps') of a calibration result pickle file,
+    cached next to it, rebuilt when the calibration result changes.
+
+    Returns:
+        map1, map2 for 'cv2.remap'
+    """
+    with open(calibration_result, 'br') as f:
+        content = f.read()
+    digest = hashlib.sha1(content).hexdigest()
+    width, height = dst_size if dst_size is not None else image_size
+    cache = '{}_remap_{}x{}_{}x{}.npz'.format(os.path.splitext(calibration_result)[0],
+                                             image_size[0], image_size[1], width, height)
+    if os.path.exists(cache):
+        try:
+            with np.load(cache) as maps:
+                if str(maps['digest']) == digest:
+                    return maps['map1'], maps['map2']
+        except (OSError, KeyError, ValueError) as e:
+            logging.warning('Failed to load remap tables {}: {}'.format(cache, e))
+
+    mtx, dist, corners, img_size = pickle.loads(content)
+    map1, map2 = undistort_and_transform_maps(mtx, dist, corners, img_size, image_size, dst_size)
+    try:
+        temp = '{}.{}.tmp'.format(cache, os.getpid())  # other processes may be loading it
+        with open(temp, 'bw') as f:
+            np.savez(f, map1=map1, map2=map2, digest=digest)
+        os.replace(temp, cache)
+        logging.info('Saved remap tables to {}'.format(cache))
+    except OSError as e:
+        logging.warning('Failed to save remap tables {}: {}'.format(cache, e))
+    return map1, map2
 
 
 def save_video_frame(file, save_prefix, wait_time=3000):
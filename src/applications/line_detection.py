@@ -18,6 +18,10 @@ def base_hist(img, bottom_half=True):
 
 def slide_window_find(binary, window_height=50, window_width=120, recenter_pixels=30, debug_output=False):
     """
+    The nonzero pixels are in row order, so the pixels of each window's band of rows are a contiguous range
+    found by binary search, and only those are tested against the window's columns:
+    the cost is linear in the number of nonzero pixels, not windows x nonzero pixels.
+
     Args:
         window_height: Choose the height of sliding windows.
         window_width: Set the width of the windows.
@@ -34,11 +38,13 @@ def slide_window_find(binary, window_height=50, window_width=120, recenter_pixel
 
     # sliding window
     # number of windows
-    nwindows = np.int(binary.shape[0] // window_height)
-    # Identify the x and y positions of all nonzero (i.e. activated) pixels in the image
-    nonzero = binary.nonzero()
-    nonzeroy = np.array(nonzero[0])
-    nonzerox = np.array(nonzero[1])
+    nwindows = int(binary.shape[0] // window_height)
+    # Identify the x and y positions of all nonzero (i.e. activated) pixels in the image, sorted by y
+    nonzeroy, nonzerox = binary.nonzero()
+    # range of the pixels in each window's band of rows, windows from the bottom
+    band_lows = binary.shape[0] - (np.arange(nwindows) + 1) * window_height
+    band_starts = np.searchsorted(nonzeroy, band_lows, side='left')
+    band_ends = np.searchsorted(nonzeroy, band_lows + window_height, side='left')
 
     # Current positions to be updated later for each window in nwindows
     line_current = line_base
@@ -57,20 +63,18 @@ def slide_window_find(binary, window_height=50, window_width=120, recenter_pixel
             # Draw the window on the visualization image
             cv2.rectangle(out_img, (win_x_low, win_y_low), (win_x_high, win_y_high), (0, 255, 0), 1)
 
-        # Identify the nonzero pixels in x and y within the window
-        good_inds = (
-                (nonzeroy >= win_y_low) & (nonzeroy < win_y_high) &
-                (nonzerox >= win_x_low) & (nonzerox < win_x_high)
-        ).nonzero()
-        good_inds = good_inds[0]
-        line_inds.append(good_inds)
+        # Identify the nonzero pixels in x within the window's band of rows
+        start = band_starts[window]
+        band_x = nonzerox[start:band_ends[window]]
+        good_inds = ((band_x >= win_x_low) & (band_x < win_x_high)).nonzero()[0]
+        line_inds.append(good_inds + start)
 
         # If found > pixels, recenter next window on their mean position
         if len(good_inds) > recenter_pixels:
-            line_current = np.int(np.mean(nonzerox[good_inds]))
+            line_current = int(np.mean(band_x[good_inds]))
 
     # Concatenate the arrays of indices (previously was a list of lists of pixels)
-    line_inds = np.concatenate(line_inds)
+    line_inds = np.concatenate(line_inds) if len(line_inds) > 0 else np.array([], dtype=np.intp)
 
     linex = nonzerox[line_inds]
     liney = nonzeroy[line_inds]
@@ -105,3 +109,18 @@ def detect_line_and_polyfit(binary, slide_window_height=50, slide_window_width=1
     else:
         fit = [0, 0, 0]
     return fit, out_img
+
+
+def line_base_near(binary, last_base: int, margin: int = 60) -> tuple:
+    """
+    Find the line base column in a band of columns around the last one, instead of the whole image.
+
+    Returns:
+        line base column, number of line pixels in that column
+    """
+    low = max(0, last_base - margin)
+    histogram = np.count_nonzero(binary[:, low:last_base + margin + 1], axis=0)
+    if len(histogram) == 0:
+        return last_base, 0
+    peak = int(np.argmax(histogram))
+    return low + peak, int(histogram[peak])
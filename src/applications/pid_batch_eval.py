@@ -0,0 +1,154 @@
+# coding=utf-8
+"""
+Evaluate the PID line follower offline over a recorded video ('VideoRecorder') or bus log ('BusRecorder').
+
+The vision part (preprocess, find line) of each frame is independent, frame chunks are spread over a process pool,
+then the steering is computed in frame order (the PID has state), from the time between the frames as on the car.
+The result is a per frame table:
+    frame, timestamp, found, line, car, cte, steering, preprocess_ms, find_ms
+In tracking mode ('track_margin'), the tracking restarts at each chunk.
+
+Usage (from the project root):
+    PYTHONPATH=src python3 -m applications.pid_batch_eval --input capture.avi --output eval.npz
+    PYTHONPATH=src python3 -m applications.pid_batch_eval --input bus.log --config config/pid_line_follower.yml \
+        --workers 4 --output eval.csv
+"""
+import argparse
+import logging
+import time
+import os
+from multiprocessing import Pool
+import numpy as np
+import yaml
+from components.pid import PIDLineFollower
+from utils import frame_source
+
+COLUMNS = ('frame', 'timestamp', 'found', 'line', 'car', 'cte', 'steering', 'preprocess_ms', 'find_ms')
+
+_pid = None  # of the worker process
+
+
+def pid_args(config_file: str) -> dict:
+    """
+    Args of the PID component in a car config file.
+    """
+    with open(config_file) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    args = dict(config['components']['pid'] or {})
+    args.pop('subscription', None)
+    args.pop('publication', None)
+    return args
+
+
+def _init_worker(args: dict):
+    global _pid
+    _pid = PIDLineFollower(**args)  # no publication: no output image
+
+
+def _eval_chunk(task: tuple) -> dict:
+    """
+    Find the line in a chunk of frames.
+
+    Returns:
+        dict of column -> array, without steering
+    """
+    source, path, channel, start, count = task
+    if source == 'file':
+        frames = frame_source.video_frames(path, start)
+    else:
+        frames = frame_source.bus_log_frames(path, channel, start)
+
+    table = {'frame': np.arange(start, start + count, dtype=np.int64),
+             'timestamp': np.zeros(count, dtype=np.float64),
+             'found': np.zeros(count, dtype=bool),
+             'line': np.zeros(count, dtype=np.int32),
+             'car': np.zeros(count, dtype=np.int32),
+             'preprocess_ms': np.zeros(count, dtype=np.float32),
+             'find_ms': np.zeros(count, dtype=np.float32)}
+    for i, (timestamp, frame) in zip(range(count), frames):
+        _pid._prepare_remap((frame.shape[1], frame.shape[0]))  # not timed
+        table['timestamp'][i] = timestamp
+        t0 = time.perf_counter()
+        binary = _pid._preprocess_image(frame)
+        t1 = time.perf_counter()
+        line, car, _ = _pid._locate_line(binary)
+        t2 = time.perf_counter()
+        table['found'][i], table['line'][i], table['car'][i] = line > 0, line, car
+        table['preprocess_ms'][i], table['find_ms'][i] = (t1 - t0) * 1000, (t2 - t1) * 1000
+    frames.close()
+    return table
+
+
+def evaluate(path: str, args: dict, workers: int = None, chunk_size: int = 200, channel: str = 'cam/image') -> dict:
+    """
+    Evaluate the PID line follower over all the frames of a video or a bus log (*.log).
+
+    Returns:
+        dict of column -> array, see 'COLUMNS'
+    """
+    source = 'buslog' if path.endswith('.log') else 'file'
+    total = frame_source.frame_count(source, path, channel)
+    if total == 0:
+        raise ValueError('no frame in {}'.format(path))
+    tasks = [(source, path, channel, start, min(chunk_size, total - start)) for start in range(0, total, chunk_size)]
+
+    with Pool(workers, initializer=_init_worker, initargs=(args,)) as pool:
+        chunks = pool.map(_eval_chunk, tasks)
+    table = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+    # steering, in frame order
+    pid = PIDLineFollower(**args)
+    table['cte'] = np.zeros(len(table['frame']), dtype=np.float32)
+    table['steering'] = np.zeros(len(table['frame']), dtype=np.float32)
+    last = None  # timestamp of the last steering
+    for i in range(len(table['frame'])):
+        dt = table['timestamp'][i] - last if last is not None else None
+        last = table['timestamp'][i]
+        if table['found'][i]:
+            table['cte'][i] = PIDLineFollower._cte(table['line'][i], table['car'][i])
+            table['steering'][i] = pid._pid_steering(table['cte'][i], dt)
+    return {name: table[name] for name in COLUMNS}
+
+
+def save(table: dict, output: str):
+    """
+    Save the table as columns in a .npz, or as a .csv.
+    """
+    if output.endswith('.csv'):
+        np.savetxt(output, np.column_stack([table[name].astype(np.float64) for name in COLUMNS]),
+                   delimiter=',', header=','.join(COLUMNS), comments='', fmt='%.6g')
+    else:
+        np.savez(output, **table)
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s:%(name)s:%(levelname)s: %(message)s', level=logging.WARNING)
+    parser = argparse.ArgumentParser(description='Offline batch evaluation of the PID line follower.')
+    parser.add_argument('--input', required=True, help='video file, or bus log (*.log)')
+    parser.add_argument('--config', default='config/pid_line_follower.yml', help='car config with the pid component')
+    parser.add_argument('--output', default='pid_eval.npz', help='*.npz or *.csv')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk', type=int, default=200, help='frames per task')
+    parser.add_argument('--channel', default='cam/image', help='camera channel in the bus log')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    table = evaluate(args.input, pid_args(args.config), args.workers, args.chunk, args.channel)
+    elapsed = time.perf_counter() - start
+    save(table, args.output)
+
+    frames = len(table['frame'])
+    print('{} frames in {:.2f}s ({:.1f} frames/s), line found in {:.1f}%'.format(
+        frames, elapsed, frames / elapsed if elapsed > 0 else 0, table['found'].mean() * 100 if frames else 0))
+    if frames > 0:
+        print('preprocess: mean {:.3f}ms, p99 {:.3f}ms; find: mean {:.3f}ms, p99 {:.3f}ms'.format(
+            table['preprocess_ms'].mean(), np.percentile(table['preprocess_ms'], 99),
+            table['find_ms'].mean(), np.percentile(table['find_ms'], 99)))
+        print('|cte|: mean {:.2f}, max {:.2f}; steering: mean {:.3f}, std {:.3f}'.format(
+            np.abs(table['cte']).mean(), np.abs(table['cte']).max(), table['steering'].mean(),
+            table['steering'].std()))
+    print('saved to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
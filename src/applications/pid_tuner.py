@@ -0,0 +1,253 @@
+# coding=utf-8
+"""
+Tune the PID coefficients offline, instead of driving laps in 'train_mode'.
+
+Recorded line position traces (the tables of 'applications.pid_batch_eval', or a video / bus log evaluated on the fly)
+are replayed through a simple kinematic car model: each step the PID steers from the simulated cross track error,
+the steering turns the simulated car, which shifts the line as seen by the camera from the recorded one.
+The recorded line positions stand for the track along the recorded path, the simulated car deviates from that path.
+The cost of a coefficient set is the mean squared cross track error, losing the line (out of the roi) costs
+the rest of the trace at the roi edge.
+
+Candidate coefficient sets are evaluated in parallel over a process pool:
+    random: log-uniform samples around the start coefficients, signs kept
+    grid: geometric grid around the start coefficients
+    twiddle: the +/- step of every coefficient evaluated at once each round
+    all: random, then twiddle from the best one
+The best coefficients are written to the 'pid_params_file' of the PID, read at the start of the car.
+
+Usage (from the project root):
+    PYTHONPATH=src python3 -m applications.pid_tuner --trace eval.npz
+    PYTHONPATH=src python3 -m applications.pid_tuner --trace bus.log --trace lap2.npz --method grid --grid-steps 9
+"""
+import argparse
+import inspect
+import itertools
+import logging
+import os
+import pickle
+import time
+from multiprocessing import Pool
+import numpy as np
+from applications import pid_batch_eval
+from components.pid import PIDLineFollower, DEFAULT_PID_COEFFS
+from utils.pid_controller import PIDController
+
+logger = logging.getLogger("PIDTuner")
+
+_traces = None  # of the worker process
+_model = None
+
+
+class CarModel:
+    """
+    Kinematic car in image (bird's view) pixels: the steering sets the yaw rate, the heading moves the car sideways
+    and turns the camera, which sees the line further sideways at the look ahead distance.
+    """
+
+    def __init__(self, interval: float = 0.1, speed: float = 300.0, max_yaw_rate: float = 1.5,
+                 look_ahead: float = 100.0, lost_cte: float = 320.0):
+        """
+        Args:
+            interval: time between two steerings (seconds), the 'steer_interval' of the PID.
+            speed: of the car, pixels per second.
+            max_yaw_rate: yaw rate at full steering, radians per second.
+            look_ahead: distance from the car to the roi, pixels.
+            lost_cte: the line is lost beyond that cross track error, half the roi width.
+        """
+        self.interval = interval
+        self.speed = speed
+        self.max_yaw_rate = max_yaw_rate
+        self.look_ahead = look_ahead
+        self.lost_cte = lost_cte
+
+    def cost(self, coeffs, line: np.ndarray, car: np.ndarray) -> float:
+        """
+        Drive a trace with the PID coefficients.
+
+        Args:
+            coeffs: [Kp, Kd, Ki]
+            line: recorded line position of each step.
+            car: car position of each step.
+
+        Returns:
+            mean squared cross track error
+        """
+        controller = PIDController(coeffs)
+        offset = 0.0  # sideways from the recorded path, pixels to the right
+        heading = 0.0  # from the recorded path, radians
+        total = 0.0
+        for i in range(len(line)):
+            cte = PIDLineFollower._cte(line[i] - offset - self.look_ahead * np.tan(heading), car[i])
+            if abs(cte) > self.lost_cte:
+                total += (len(line) - i) * self.lost_cte ** 2
+                break
+            total += cte ** 2
+            steering = controller.steer(cte)
+            heading = np.clip(heading + steering * self.max_yaw_rate * self.interval, -1.2, 1.2)
+            offset += self.speed * np.sin(heading) * self.interval
+        return total / len(line)
+
+
+def load_trace(path: str, args: dict = None, workers: int = None) -> tuple:
+    """
+    Line positions of a trace: a table (*.npz, *.csv) of 'applications.pid_batch_eval',
+    or a video / bus log (*.log) evaluated with the PID args.
+    The steps where the line was not found keep the last found position.
+
+    Returns:
+        (line, car) arrays
+    """
+    if path.endswith('.npz'):
+        with np.load(path) as table:
+            table = {name: table[name] for name in ('found', 'line', 'car')}
+    elif path.endswith('.csv'):
+        rows = np.genfromtxt(path, delimiter=',', names=True)
+        table = {name: rows[name] for name in ('found', 'line', 'car')}
+    else:
+        table = pid_batch_eval.evaluate(path, args, workers)
+
+    found = table['found'].astype(bool)
+    if not found.any():
+        raise ValueError('line never found in {}'.format(path))
+    indices = np.maximum.accumulate(np.where(found, np.arange(len(found)), 0))
+    indices[:np.argmax(found)] = np.argmax(found)  # before the first found
+    return table['line'][indices].astype(np.float64), table['car'][indices].astype(np.float64)
+
+
+def _init_worker(traces: list, model: CarModel):
+    global _traces, _model
+    _traces, _model = traces, model
+
+
+def _cost(coeffs) -> float:
+    """
+    Cost of the coefficients over all the traces, weighted by their length.
+    """
+    steps = sum(len(line) for line, _ in _traces)
+    return sum(_model.cost(coeffs, line, car) * len(line) for line, car in _traces) / steps
+
+
+class Tuner:
+    """
+    Search of the PID coefficients, candidates are evaluated over the worker pool.
+    """
+
+    def __init__(self, pool: Pool, start, seed: int = None):
+        self.pool = pool
+        self.best = np.array(start, dtype=np.float64)
+        self.best_cost = self.evaluate([self.best])[0]
+        self.start_cost = self.best_cost
+        self.evaluations = 1
+        self.random = np.random.RandomState(seed)
+
+    def evaluate(self, candidates: list) -> list:
+        return self.pool.map(_cost, [np.asarray(c, dtype=np.float64) for c in candidates])
+
+    def _keep_best(self, candidates: list) -> bool:
+        costs = self.evaluate(candidates)
+        self.evaluations += len(candidates)
+        i = int(np.argmin(costs))
+        if costs[i] < self.best_cost:
+            self.best, self.best_cost = np.array(candidates[i], dtype=np.float64), costs[i]
+            return True
+        return False
+
+    def random_search(self, samples: int, spread: float = 4.0):
+        """
+        Log-uniform samples within [1 / spread, spread] times the best coefficients.
+        """
+        factors = np.exp(self.random.uniform(-np.log(spread), np.log(spread), (samples, len(self.best))))
+        self._keep_best(list(self.best * factors))
+        logger.info('random: cost {:.2f}, {}'.format(self.best_cost, self.best))
+
+    def grid_search(self, steps: int, spread: float = 4.0):
+        """
+        Geometric grid of steps ^ 3 points within [1 / spread, spread] times the best coefficients.
+        """
+        axes = [c * np.geomspace(1 / spread, spread, steps) for c in self.best]
+        self._keep_best([list(point) for point in itertools.product(*axes)])
+        logger.info('grid: cost {:.2f}, {}'.format(self.best_cost, self.best))
+
+    def twiddle(self, rounds: int = 100, tolerance: float = 0.01):
+        """
+        Twiddle from the best coefficients, a step of 1/10 of each to start with,
+        until the steps are below the tolerance (relative to the coefficients).
+        """
+        d = np.abs(self.best) / 10.0
+        for r in range(rounds):
+            candidates = []
+            for i in range(len(self.best)):
+                for sign in (1, -1):
+                    candidate = self.best.copy()
+                    candidate[i] += sign * d[i]
+                    candidates.append(candidate)
+            previous = self.best
+            if self._keep_best(candidates):
+                d[np.argmax(np.abs(self.best - previous))] *= 1.1
+            else:
+                d *= 0.9
+            if np.all(d <= tolerance * np.maximum(np.abs(self.best), 1e-12)):
+                break
+        logger.info('twiddle: cost {:.2f}, {} after {} round(s)'.format(self.best_cost, self.best, r + 1))
+
+
+def start_coeffs(pid_params_file: str):
+    """
+    The coefficients the PID would start with.
+    """
+    if os.path.exists(pid_params_file):
+        with open(pid_params_file, 'br') as f:
+            return pickle.load(f)
+    return DEFAULT_PID_COEFFS
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s:%(name)s:%(levelname)s: %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Offline PID coefficient tuning on recorded line traces.')
+    parser.add_argument('--trace', required=True, action='append',
+                        help='table of pid_batch_eval (*.npz, *.csv), video file or bus log (*.log), repeatable')
+    parser.add_argument('--config', default='config/pid_line_follower.yml', help='car config with the pid component')
+    parser.add_argument('--output', help='coefficients file, the pid_params_file of the PID by default')
+    parser.add_argument('--method', default='all', choices=('all', 'random', 'grid', 'twiddle'))
+    parser.add_argument('--samples', type=int, default=512, help='random samples')
+    parser.add_argument('--grid-steps', type=int, default=7, help='grid steps per coefficient, steps ^ 3 candidates')
+    parser.add_argument('--spread', type=float, default=4.0, help='random / grid range, times the start coefficients')
+    parser.add_argument('--rounds', type=int, default=100, help='twiddle rounds')
+    parser.add_argument('--speed', type=float, default=300.0, help='car speed, pixels per second')
+    parser.add_argument('--max-yaw-rate', type=float, default=1.5, help='yaw rate at full steering, radians per second')
+    parser.add_argument('--look-ahead', type=float, default=100.0, help='distance from the car to the roi, pixels')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    pid = pid_batch_eval.pid_args(args.config)
+    defaults = inspect.signature(PIDLineFollower).parameters
+    pid_params_file = pid.get('pid_params_file', defaults['pid_params_file'].default)
+    roi = pid.get('roi', defaults['roi'].default)
+    model = CarModel(pid.get('steer_interval', defaults['steer_interval'].default), args.speed, args.max_yaw_rate,
+                     args.look_ahead, (roi[1][0] - roi[0][0]) / 2)
+    traces = [load_trace(path, pid, args.workers) for path in args.trace]
+
+    start = time.perf_counter()
+    with Pool(args.workers, initializer=_init_worker, initargs=(traces, model)) as pool:
+        tuner = Tuner(pool, start_coeffs(pid_params_file), args.seed)
+        if args.method in ('all', 'random'):
+            tuner.random_search(args.samples, args.spread)
+        if args.method == 'grid':
+            tuner.grid_search(args.grid_steps, args.spread)
+        if args.method in ('all', 'twiddle'):
+            tuner.twiddle(args.rounds)
+    elapsed = time.perf_counter() - start
+
+    output = args.output or pid_params_file
+    with open(output, 'bw') as f:
+        pickle.dump(tuner.best, f)
+    print('{} candidate(s) over {} step(s) in {:.2f}s'.format(
+        tuner.evaluations, sum(len(line) for line, _ in traces), elapsed))
+    print('cost {:.2f} -> {:.2f}, coefficients {} saved to {}'.format(
+        tuner.start_cost, tuner.best_cost, tuner.best.tolist(), output))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,8 @@
 import yaml
 import importlib
 import ast
-from components import Component, CAN, ZmqCAN
+from components import Component, CAN, ZmqCAN, LocalCAN
+from utils import event_loop
 import logging
 import sys
 import os
@@ -53,16 +54,7 @@ class Car:
 
         for component in self.config['components']:
             comp_module = str(component)
-            pwd = os.path.abspath('.')
-            if pwd.endswith('src'):
-                pwd = os.path.abspath('components')
-            else:
-                pwd = os.path.abspath('src/components')
-
-            with open(pwd + '/' + comp_module + '.py', 'r') as f:
-                source = '\n'.join(f.readlines())
-                p = ast.parse(source)
-                classes = [node.name for node in ast.walk(p) if isinstance(node, ast.ClassDef)]
+            classes = Car._component_classes(comp_module)
             if len(classes) == 0:
                 raise ValueError("submodule '{}' contains no component class!".format(comp_module))
 
@@ -73,6 +65,21 @@ class Car:
                     if cls in self.config['components'][component]:
                         self._add_component(component, cls)
 
+    @staticmethod
+    def _component_classes(comp_module: str) -> list:
+        """
+        Names of the classes defined in a component module, parsed without importing it.
+        """
+        pwd = os.path.abspath('.')
+        if pwd.endswith('src'):
+            pwd = os.path.abspath('components')
+        else:
+            pwd = os.path.abspath('src/components')
+
+        with open(pwd + '/' + comp_module + '.py', 'r') as f:
+            p = ast.parse(f.read())
+        return [node.name for node in ast.walk(p) if isinstance(node, ast.ClassDef)]
+
     def _add_component(self, component_module, component_class_name):
         component_class = getattr(importlib.import_module('components.' + component_module), component_class_name)
         if not issubclass(component_class, Component):
@@ -104,12 +111,8 @@ class Car:
         # do subscription
         if not issubclass(component_class, CAN) and can_instance_or_class is not None:
             if inspect.isclass(can_instance_or_class) and issubclass(can_instance_or_class, ZmqCAN):
-                comp_instance.can = ZmqCAN(False)  # ZmqCAN client
-                comp_instance.can.start()
-                can_thread = Thread(name='{}-CAN_client-run'.format(component_class.__name__),
-                                    target=comp_instance.can.run,
-                                    args=(stop_event,))
-                can_thread.start()
+                # ZmqCAN client, shared by the components within the process
+                comp_instance.can = ZmqCAN.process_client(can_args, stop_event)
             elif isinstance(can_instance_or_class, CAN):  # shared instance
                 comp_instance.can = can_instance_or_class
             else:  # class
@@ -129,7 +132,11 @@ class Car:
             if len(comp_instance.subscription) > 0:
                 comp_instance.can.subscribe(comp_instance.subscription, comp_instance.on_message)
 
-        if comp_instance.start():
+        started = comp_instance.start()
+        if started and inspect.iscoroutinefunction(comp_instance.run):
+            # async component, shares the process event loop with the other async components
+            event_loop.run_coroutine(comp_instance.run(stop_event), '{}-run'.format(component_class.__name__))
+        elif started:
             t = Thread(name='{}-run'.format(component_class.__name__),
                        target=comp_instance.run,
                        args=(stop_event,),
@@ -145,8 +152,10 @@ class Car:
         else:
             def run_in_process(comp_class, comp_args, can_class, can_args, stop_event):
                 comp_instance = Car._inner_start_component(comp_class, comp_args, can_class, can_args, stop_event)
-                time.sleep(self.ttl)
+                stop_event.wait(self.ttl)
                 comp_instance.shutdown()
+                if comp_instance.can is not None:
+                    comp_instance.can.shutdown()
 
             p = Process(name='{}'.format(component_class),
                         target=run_in_process,
@@ -168,9 +177,25 @@ class Car:
                 # ZmqCAN server
                 if not can_args.get('server_mode'):
                     raise ValueError('ZmqCAN should be configured with server_mode: true')
-
-                can_server = self._start_component(can_class, can_args, None, None)
-                self._register_component(can_server)
+                local_dispatch = can_args.pop('local_dispatch', True)
+
+                if not self.parallel_process and local_dispatch:
+                    # all components share this interpreter, pass messages in-process instead
+                    logger.info('Using LocalCAN for thread level parallel components.')
+                    self.can = self._start_component(LocalCAN,
+                                                     {'channels': can_args.get('channels'),
+                                                      'trace': can_args.get('trace', False),
+                                                      'groups': can_args.get('groups')},
+                                                     None, None)
+                    self._register_component(self.can)
+                else:
+                    # frames between processes go through shared memory
+                    can_args.setdefault('shared_memory', self.parallel_process)
+                    if not self.parallel_process:  # the broker and clients share this interpreter
+                        can_args.setdefault('transport', 'inproc')
+
+                    can_server = self._start_component(can_class, can_args, None, None)
+                    self._register_component(can_server)
             elif not self.parallel_process:
                 # shared CAN
                 self.can = self._start_component(can_class, can_args, None, None)
@@ -194,6 +219,11 @@ class Car:
         for comp in self.component_instances:
             comp.shutdown()
 
+        # CAN clients of the components
+        cans = set(comp.can for comp in self.component_instances if comp.can is not None)
+        for can in cans.difference(self.component_instances):
+            can.shutdown()
+
 
 def main():
     logging.basicConfig(format='%(asctime)s:%(name)s:%(threadName)s:%(levelname)s: %(message)s',
@@ -1,5 +1,6 @@
 from .component import Component
 from .can import CAN
 from .zmq_can import ZmqCAN
+from .local_can import LocalCAN
 
-__all__ = ["Component", "CAN", "ZmqCAN"]
+__all__ = ["Component", "CAN", "ZmqCAN", "LocalCAN"]
@@ -0,0 +1,40 @@
+# coding=utf-8
+from components import Component
+from utils.bus_log import BusLogWriter
+import logging
+import time
+
+logger = logging.getLogger("BusRecorder")
+
+
+class BusRecorder(Component):
+    """
+    Record the CAN messages to a bus log ('utils.bus_log'), to be replayed by 'BusReplayer'.
+    Subscribe to '*' to record all channels. Messages are timestamped (time.monotonic()) when received,
+    the channels' delivery policies apply, e.g. a 'latest' channel is recorded at the pace the recorder keeps up with.
+
+    subscriptions: the channels to record
+    """
+
+    def __init__(self, path: str = './bus.log', compress: str = None, quality: int = None,
+                 chunk_size: int = 64 * 1024 * 1024):
+        """
+        Args:
+            path: the log file.
+            compress: [Optional] store images compressed, 'jpeg' or 'png', raw by default.
+            quality: [Optional] jpeg quality (0-100), or png compression level (0-9).
+            chunk_size: the log file grows by that many bytes.
+        """
+        super(BusRecorder, self).__init__()
+        logger.info('BusRecorder will save messages to {}'.format(path))
+        self.writer = BusLogWriter(path, chunk_size, compress, quality)
+
+    def on_message(self, channel, content):
+        if self.writer is not None:
+            self.writer.append(channel, content, time.monotonic())
+
+    def shutdown(self):
+        logger.info('Stopping BusRecorder')
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
@@ -0,0 +1,64 @@
+# coding=utf-8
+from components import Component
+from utils.bus_log import BusLogReader
+import logging
+import time
+
+logger = logging.getLogger("BusReplayer")
+
+
+class BusReplayer(Component):
+    """
+    Publish the messages of a bus log ('utils.bus_log', recorded by 'BusRecorder') back onto the CAN,
+    on their recorded channels, e.g. to run 'PIDLineFollower' on a recorded drive without the car.
+    """
+
+    def __init__(self, path: str = './bus.log', speed: float = 1.0, loop: bool = False, channels: list = None):
+        """
+        Args:
+            path: the log file.
+            speed: 1.0 for real time, N for N times faster, 0 for as fast as possible.
+            loop: start over at the end of the log.
+            channels: [Optional] only replay these channels.
+        """
+        super(BusReplayer, self).__init__()
+        if speed < 0:
+            raise ValueError('BusReplayer speed should be >= 0.')
+        self.reader = BusLogReader(path)
+        self.speed = speed
+        self.loop = loop
+        self.channels = set(channels) if channels is not None else None
+        self.replayed = 0
+
+    def start(self) -> bool:
+        logger.info('Replaying {} at {}.'.format(self.reader.path,
+                                                 '{}x speed'.format(self.speed) if self.speed > 0 else 'full speed'))
+        return True
+
+    def run(self, stop_event):
+        began = time.time()
+        while not stop_event.is_set():
+            start = time.time()
+            first = None
+            for timestamp, channel, message in self.reader:
+                if stop_event.is_set():
+                    break
+                if self.channels is not None and channel not in self.channels:
+                    continue
+
+                if self.speed > 0:
+                    if first is None:
+                        first = timestamp
+                    delay = start + (timestamp - first) / self.speed - time.time()
+                    if delay > 0 and stop_event.wait(delay):
+                        break
+                self.can.publish(channel, message, producer=self.__class__.__name__)
+                self.replayed += 1
+
+            if not self.loop:
+                break
+        logger.info('Replayed {} message(s) in {:.2f}s.'.format(self.replayed, time.time() - began))
+
+    def shutdown(self):
+        logger.info('Stopping BusReplayer')
+        self.reader.close()
@@ -1,7 +1,12 @@
 # coding=utf-8
 from components import Component
+from utils.frame_ring import FrameRing
+from utils.frame import Frame
+from utils import frame_source
+from threading import Thread
 import cv2
 import logging
+import numpy as np
 import sys
 import time
 
@@ -12,6 +17,31 @@ class Camera(Component):
     """
     IMX219 CSI Camera and USB camera.
     publications: camera captured image
+
+    Frames are captured by a grabber thread, in place into a ring of preallocated frames ('utils.frame_ring'),
+    and the newest one is published at 'frame_rate', so a slow publish never stalls the capture.
+    Frames captured but never published (camera faster than 'frame_rate') are counted as dropped,
+    publishing ticks without a new frame (camera slower) as duplicated.
+
+    Frames are published as 'utils.frame.Frame': the image with its capture time (time.monotonic(),
+    from the GStreamer buffer timestamp when the backend provides it) and its index (frame counter).
+
+    Derived variants of each frame can be published to their own channels, each is computed once per frame,
+    and only when the channel has subscribers. A variant applies roi (crop), resize and gray, in that order, e.g.:
+        variants:
+          cam/stream: {resize: [480, 270]}
+          cam/gray: {gray: true}
+          cam/road: {roi: [[0, 210], [640, 310]], gray: true}
+
+    Instead of the camera device, frames can come from an offline 'source' ('utils.frame_source'),
+    e.g. to run the vision pipeline on a dev box, or to benchmark it:
+        file: a video file at 'path'.
+        directory: the images in 'path', in file name order.
+        buslog: the 'cam/image' (or 'source_channel') frames of a bus log ('BusRecorder') at 'path'.
+    Every frame of an offline source is published, in order, paced by 'pacing':
+        realtime: as recorded (the video's or the log's timestamps, 'frame_rate' for images).
+        fixed: at 'frame_rate'.
+        fast: as fast as possible.
     """
 
     def __init__(self,
@@ -21,12 +51,29 @@ class Camera(Component):
                  frame_rate=21,
                  flip_mode=0,
                  capture_width=3280,
-                 capture_height=2464):
+                 capture_height=2464,
+                 ring_slots=3,
+                 publish_duplicates=False,
+                 variants=None,
+                 source='camera',
+                 path=None,
+                 pacing='realtime',
+                 loop=False,
+                 source_channel='cam/image'):
         """
         flip_mode = 0 - no flip
         flip_mode = 1 - rotate CCW 90
         flip_mode = 2 - flip vertically
         flip_mode = 3 - rotate CW 90
+
+        ring_slots: number of preallocated frames between the grabber and the publisher.
+        publish_duplicates: publish the last frame again when there is no new frame at a publishing tick.
+        variants: dict of channel -> variant spec (roi: [[x1, y1], [x2, y2]], resize: [width, height], gray: bool).
+        source: 'camera', or an offline source: 'file', 'directory' or 'buslog'.
+        path: path of the offline source.
+        pacing: of an offline source, 'realtime', 'fixed' or 'fast'.
+        loop: start an offline source over at its end.
+        source_channel: channel of the frames in a bus log source.
         """
         super(Camera, self).__init__()
         self.device = device
@@ -37,9 +84,43 @@ class Camera(Component):
         self.capture_width = capture_width
         self.capture_height = capture_height
 
+        self.ring_slots = ring_slots
+        self.publish_duplicates = publish_duplicates
+        self.variants = {}
+        for channel, spec in (variants or {}).items():
+            unknown = set(spec).difference(('roi', 'resize', 'gray'))
+            if len(unknown) > 0:
+                raise ValueError("unknown option(s) {} of camera variant {}, should be: roi, resize, gray"
+                                 .format(unknown, channel))
+            self.variants[channel] = spec
+
+        if source != 'camera' and source not in frame_source.SOURCES:
+            raise ValueError("unknown camera source '{}', should be one of: camera, {}"
+                             .format(source, ', '.join(frame_source.SOURCES)))
+        if source != 'camera' and path is None:
+            raise ValueError("Camera source '{}' requires a path.".format(source))
+        if pacing not in ('realtime', 'fixed', 'fast'):
+            raise ValueError("unknown camera pacing '{}', should be one of: realtime, fixed, fast".format(pacing))
+        self.source = source
+        self.path = path
+        self.pacing = pacing
+        self.loop = loop
+        self.source_channel = source_channel
+
         self.camera = None
+        self.ring = None
+        self.grabber = None
+        self.captured = 0
+        self._pts_offset = None  # monotonic time - buffer timestamp
+        self.published = 0
+        self.dropped = 0
+        self.duplicated = 0
 
     def start(self) -> bool:
+        if self.source != 'camera':
+            logger.info('Camera started, {} source {}, {} pacing.'.format(self.source, self.path, self.pacing))
+            return True
+
         if 'darwin' in sys.platform.lower() or 'windows' in sys.platform.lower():
             self.camera = cv2.VideoCapture(self.device)
         else:
@@ -56,9 +137,12 @@ class Camera(Component):
                 cv2.CAP_GSTREAMER
             )
 
-        self.camera.read()
+        ok, frame = self.camera.read()
+        if not ok:
+            raise IOError('Failed to read from camera {}.'.format(self.device))
+        self.ring = FrameRing(frame.shape, frame.dtype, self.ring_slots)
         time.sleep(2)  # warm up
-        logger.info('Camera started.')
+        logger.info('Camera started, {}x{} at {} fps.'.format(frame.shape[1], frame.shape[0], self.frame_rate))
         return True
 
     def _gstreamer_pipeline(self, device, capture_width=3280, capture_height=2464,
@@ -74,10 +158,127 @@ class Camera(Component):
                 device, output_width, output_height)
 
     def run(self, stop_event):
+        if self.source != 'camera':
+            self._play(stop_event)
+            return
+
+        self.grabber = Thread(name='Camera-grab', target=self._grab, args=(stop_event,), daemon=True)
+        self.grabber.start()
+
+        period = 1.0 / self.frame_rate
+        last_seq = 0
+        next_tick = time.monotonic()
         while not stop_event.is_set():
-            _, frame = self.camera.read()
-            self.publish_message(frame)
+            if self.ring.seq == last_seq and not self.publish_duplicates:  # no new frame, skip the copy
+                latest = None
+                if last_seq > 0:
+                    self.duplicated += 1
+            else:
+                latest = self.ring.latest()
+            if latest is not None:
+                seq, timestamp, frame = latest
+                frame = Frame(frame, timestamp, seq)
+                if seq != last_seq:
+                    self.dropped += seq - last_seq - 1
+                    self._publish(frame, timestamp)
+                else:
+                    self.duplicated += 1
+                    if self.publish_duplicates:
+                        self._publish(frame, timestamp)
+                last_seq = seq
+
+            next_tick += period
+            delay = next_tick - time.monotonic()
+            if delay < 0:  # publishing fell behind, skip the missed ticks
+                next_tick -= delay // period * period
+                delay = 0
+            stop_event.wait(delay)
+        self.grabber.join()
+
+    def _play(self, stop_event):
+        """
+        Publish every frame of the offline source.
+        """
+        while not stop_event.is_set():
+            start = time.monotonic()
+            first = None
+            played = self.captured
+            for index, (timestamp, frame) in enumerate(frame_source.open_source(self.source, self.path,
+                                                                                self.frame_rate,
+                                                                                self.source_channel)):
+                if self.pacing == 'realtime':
+                    first = timestamp if first is None else first
+                    delay = start + timestamp - first - time.monotonic()
+                elif self.pacing == 'fixed':
+                    delay = start + index / self.frame_rate - time.monotonic()
+                else:
+                    delay = 0
+                if (delay > 0 and stop_event.wait(delay)) or stop_event.is_set():
+                    break
+                self.captured += 1
+                frame = Frame(frame, time.monotonic(), self.captured)
+                self._publish(frame, frame.timestamp)
+
+            if self.captured == played and not stop_event.is_set():  # nothing to loop over
+                logger.warning('Camera source {} has no frame.'.format(self.path))
+                break
+            if not self.loop:
+                logger.info('Camera source {} finished.'.format(self.path))
+                break
+
+    def _publish(self, frame, timestamp: float):
+        self.publish_message(frame, origin=timestamp)
+        self.published += 1
+        for channel, spec in self.variants.items():
+            if self.can.has_subscribers(channel):
+                self.can.publish(channel, Frame.of(Camera._variant(frame, spec), frame), origin=timestamp,
+                                 producer=self.__class__.__name__)
+
+    @staticmethod
+    def _variant(frame, spec: dict):
+        if 'roi' in spec:
+            (x1, y1), (x2, y2) = spec['roi']
+            frame = frame[y1:y2, x1:x2]
+        if 'resize' in spec:
+            frame = cv2.resize(frame, tuple(spec['resize']), interpolation=cv2.INTER_AREA)
+        if spec.get('gray') and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return frame
+
+    def _grab(self, stop_event):
+        while not stop_event.is_set():
+            slot, buffer = self.ring.acquire()
+            ok, frame = self.camera.read(image=buffer)
+            timestamp = self._capture_time(time.monotonic())
+            if not ok:
+                logger.warning('Failed to read from camera {}.'.format(self.device))
+                stop_event.wait(0.1)
+                continue
+            if frame is not buffer:  # not read in place, e.g. frame size changed
+                if frame.shape != self.ring.shape:
+                    logger.warning('Dropped a frame of unexpected shape {}.'.format(frame.shape))
+                    continue
+                np.copyto(buffer, frame)
+            self.ring.commit(slot, timestamp)
+            self.captured += 1
+
+    def _capture_time(self, now: float) -> float:
+        """
+        Capture time of the frame just read, from the buffer timestamp if available, otherwise the read time.
+        The buffer timestamp is mapped to the monotonic clock by the smallest offset seen (the least delayed read).
+        """
+        pts = self.camera.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        if pts <= 0:
+            return now
+        if self._pts_offset is None or now - pts < self._pts_offset:
+            self._pts_offset = now - pts
+        return pts + self._pts_offset
 
     def shutdown(self):
         time.sleep(1)
-        logger.info('Camera shutdown.')
+        if self.grabber is not None:
+            self.grabber.join(1)
+        if self.camera is not None:
+            self.camera.release()
+        logger.info('Camera shutdown, captured {}, published {}, dropped {}, duplicated {} frame(s).'
+                    .format(self.captured, self.published, self.dropped, self.duplicated))
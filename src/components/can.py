@@ -1,25 +1,383 @@
 # coding=utf-8
 from components import Component
+from utils.mailbox import Mailbox, parse_policy
+from utils.can_trace import CANTrace, Envelope
+from utils import can_codec
+from utils import event_loop
+from threading import Thread, Lock
+from contextvars import ContextVar
+import asyncio
+import inspect
+import logging
+import time
+import numpy as np
 import types
 import typing
 
+logger = logging.getLogger("CAN")
+
 
 class CAN(Component):
     """
     CAN - Controller Area Network.
     The message bus of the Car.
+
+    Received messages are put into a mailbox per listener, and delivered by a dispatch thread per listener,
+    so a slow listener can not delay the others.
+    How many pending messages a mailbox keeps is set by the channel's delivery policy,
+    configured with 'channels' in the CAN's config, e.g.:
+        channels:
+          cam/image: latest      # only the newest frame is kept
+          pid_image_out: queue(5) # at most 5 pending, the oldest is dropped
+          js_record: all         # lossless (default)
+
+    Channels are in one of two lanes: 'control' (steering, throttle, switches...) and 'bulk' (images),
+    control messages never queue behind bulk ones, they are dispatched first.
+    The lane is declared with the delivery policy, or else fixed by the first message published to the channel
+    (typed channels are control, numpy arrays and None are bulk, anything else is control):
+        channels:
+          cam/image: {policy: latest, lane: bulk}
+          pid_steering: {lane: control}
+
+    Scalar channels can declare a type (see 'utils.can_codec.TYPES', or a struct layout 'struct:<format>'),
+    related typed channels published together (by one 'publish_message') can be grouped,
+    a group is sent as one atomic message, and its listeners see the values of the same instant:
+        channels:
+          js_steering: {type: float32}
+          js_throttle: {type: float32}
+          js_autonomous: {type: bool}
+        groups:
+          js: [js_steering, js_throttle, js_autonomous]
+
+    A listener can be a coroutine function ('async def on_message'), it is then dispatched by a task
+    on the process event loop ('utils.event_loop') instead of a thread.
+    Coroutines can also iterate over the messages of channels with 'messages':
+        async for channel, message in can.messages(['cam/image']):
+            ...
+
+    Subscribing to '*' receives the messages of all channels, e.g. to record the bus ('BusRecorder').
+
+    Publishers can skip producing outputs nobody consumes (e.g. debug images) with 'has_subscribers',
+    'subscriber_counts' gives the live number of listeners of each channel.
+
+    With 'trace', every message carries an envelope (origin time, sequence number, producer, see 'utils.can_trace'),
+    per channel latency histograms and sequence gaps are logged at shutdown.
+    A listener gets the origin of the message it is handling with 'message_origin', and passes it on
+    when publishing derived messages, so the age at the end of a chain (e.g. capture -> steering) is measured.
     """
+    CONTROL = 'control'
+    BULK = 'bulk'
+    ALL_CHANNELS = '*'
+    SUBSCRIPTIONS = '_can/subscriptions'  # reserved, subscription announcements between the processes
+
+    def __init__(self, channels: dict = None, trace: bool = False, groups: dict = None):
+        """
+        Args:
+            channels: dict of channel -> delivery policy: 'all', 'latest' or 'queue(N)',
+                or dict of channel -> {policy: <delivery policy>, lane: <'control' or 'bulk'>, type: <type>}.
+            trace: attach envelopes to messages and collect latency stats.
+            groups: dict of group name -> list of typed channels.
+        """
+        super(CAN, self).__init__()
+        self.channel_policies = {}
+        self.channel_lanes = {}
+        self.channel_types = {}  # channel -> struct format
+        for channel, spec in (channels or {}).items():
+            if not isinstance(spec, dict):
+                spec = {'policy': spec}
+            self.channel_policies[channel] = parse_policy(spec.get('policy'))
+            if 'lane' in spec:
+                if spec['lane'] not in (CAN.CONTROL, CAN.BULK):
+                    raise ValueError("unknown lane '{}' of channel {}, should be 'control' or 'bulk'"
+                                     .format(spec['lane'], channel))
+                self.channel_lanes[channel] = spec['lane']
+            if 'type' in spec:
+                self.channel_types[channel] = can_codec.struct_format(spec['type'])
+
+        self.groups = {}  # group name -> tuple of channels
+        self.channel_groups = {}  # channel -> group name
+        for group, members in (groups or {}).items():
+            untyped = [channel for channel in members if channel not in self.channel_types]
+            if len(untyped) > 0:
+                raise ValueError("channels {} of group '{}' should declare a type.".format(untyped, group))
+            self.groups[group] = tuple(members)
+            for channel in members:
+                self.channel_groups[channel] = group
+
+        self.listeners = {}  # channel -> tuple of listeners
+        self.mailboxes = {}  # listener -> mailbox
+        self._dispatch_lock = Lock()
 
-    def publish(self, channel: str, message):
+        # tracing
+        self.tracer = CANTrace() if trace else None
+        self._seqs = {}  # (producer, channel) -> last sequence number
+        self._current = ContextVar('envelope', default=None)  # of the message being dispatched, per thread/task
+
+    def publish(self, channel: str, message, origin: float = None, producer: str = None):
         """
         Publish a message to specified channel.
         message will be serialized and encoded.
+
+        Args:
+            origin: (tracing) time.monotonic() when the data was created, default now.
+            producer: (tracing) who publishes the message.
         """
         raise TypeError("{} - publish not implemented!")
 
+    def publish_many(self, messages: list, origin: float = None, producer: str = None):
+        """
+        Publish messages of different channels at once, e.g. all the outputs of a component.
+
+        Args:
+            messages: list of (channel, message)
+        """
+        for channel, message in messages:
+            self.publish(channel, message, origin=origin, producer=producer)
+
     def subscribe(self, channels: typing.Iterable, listener: types.MethodType):
         """
         Subscribe to a channel.
         message will be decoded and deserialized.
         """
         raise TypeError("{} - subscribe not implemented!")
+
+    def subscriber_counts(self) -> dict:
+        """
+        Number of listeners of each channel ('*' for those of all channels).
+
+        Returns:
+            dict of channel -> count
+        """
+        return {channel: len(listeners) for channel, listeners in self.listeners.items()}
+
+    def unsubscribe(self, listener: types.MethodType):
+        """
+        Remove a listener from all its channels, its pending messages are discarded.
+        """
+        with self._dispatch_lock:
+            for channel, listeners in list(self.listeners.items()):
+                if listener in listeners:
+                    remaining = tuple(l for l in listeners if l != listener)
+                    if len(remaining) > 0:
+                        self.listeners[channel] = remaining
+                    else:
+                        del self.listeners[channel]
+            mailbox = self.mailboxes.pop(listener, None)
+        if mailbox is not None:
+            mailbox.close()  # ends its dispatch thread or task
+
+    def has_subscribers(self, channel: str) -> bool:
+        """
+        Whether a message published to the channel would be received by anyone,
+        so the publisher can skip producing it.
+        """
+        counts = self.subscriber_counts()
+        return counts.get(channel, 0) + counts.get(CAN.ALL_CHANNELS, 0) > 0
+
+    def _complete_groups(self, messages: list) -> tuple:
+        """
+        Split the messages into complete groups and the others.
+
+        Returns:
+            list of (group, [messages in group's channel order]), list of other (channel, message)
+        """
+        by_channel = dict(messages)
+        groups = []
+        for group, members in self.groups.items():
+            if all(channel in by_channel for channel in members):
+                groups.append((group, [by_channel.pop(channel) for channel in members]))
+        return groups, [(channel, message) for channel, message in messages if channel in by_channel]
+
+    def _add_listener(self, channels: typing.Iterable, listener: types.MethodType):
+        """
+        Register the listener to the channels, and start its dispatch thread.
+        """
+        with self._dispatch_lock:
+            if isinstance(listener, _Inbox):  # consumed by a 'messages' iteration
+                self.mailboxes[listener] = listener.mailbox
+            elif listener not in self.mailboxes and inspect.iscoroutinefunction(listener):
+                wake = event_loop.Wake(event_loop.process_loop())
+                mailbox = Mailbox(self.channel_policies, notify=wake.set)
+                self.mailboxes[listener] = mailbox
+                event_loop.run_coroutine(self._dispatch_async(listener, mailbox, wake), '{} dispatch'.format(listener))
+            elif listener not in self.mailboxes:
+                mailbox = Mailbox(self.channel_policies)
+                self.mailboxes[listener] = mailbox
+                Thread(name='{}-{}-dispatch'.format(getattr(listener, '__self__', listener).__class__.__name__,
+                                                    self.__class__.__name__),
+                       target=self._dispatch,
+                       args=(listener, mailbox),
+                       daemon=True).start()
+
+            for channel in channels:
+                # copy on write, deliver without lock
+                self.listeners[channel] = self.listeners.get(channel, ()) + (listener,)
+
+    def _envelope(self, channel: str, origin: float, producer: str) -> Envelope:
+        """
+        Envelope of a message to publish, None if not tracing.
+        """
+        if self.tracer is None:
+            return None
+        now = time.monotonic()
+        seq = self._seqs.get((producer, channel), 0) + 1
+        self._seqs[(producer, channel)] = seq
+        return Envelope(origin if origin is not None else now, seq, producer or '', now)
+
+    def _lane(self, channel: str, message) -> str:
+        """
+        The lane of a message to publish.
+        """
+        lane = self.channel_lanes.get(channel)
+        if lane is None:  # fixed by the first message, so the channel's messages stay in order
+            if channel in self.channel_types:  # scalars, also sent in groups on the control lane
+                lane = CAN.CONTROL
+            else:
+                lane = CAN.BULK if message is None or isinstance(message, np.ndarray) else CAN.CONTROL
+            self.channel_lanes[channel] = lane
+        return lane
+
+    def _deliver(self, channel: str, message, envelope: Envelope = None, lane: str = CONTROL):
+        """
+        Put the message into the mailboxes of the channel's listeners.
+        """
+        if envelope is not None and self.tracer is not None:
+            self.tracer.received(channel, envelope)
+        urgent = lane == CAN.CONTROL
+        for listener in self._listeners(channel):
+            mailbox = self.mailboxes.get(listener)
+            if mailbox is not None:
+                mailbox.put(channel, (message, envelope), urgent)
+
+    def _deliver_group(self, group: str, messages: list, envelope: Envelope = None, lane: str = CONTROL):
+        """
+        Put the messages of a group into the mailboxes of the listeners, atomically for each listener.
+        """
+        if envelope is not None and self.tracer is not None:
+            self.tracer.received(group, envelope)
+        items = {}  # listener -> list of (channel, (message, envelope))
+        for channel, message in zip(self.groups[group], messages):
+            for listener in self._listeners(channel):
+                items.setdefault(listener, []).append((channel, (message, envelope)))
+        for listener, listener_items in items.items():
+            mailbox = self.mailboxes.get(listener)
+            if mailbox is not None:
+                mailbox.put_many(listener_items, lane == CAN.CONTROL)
+
+    def _listeners(self, channel: str) -> tuple:
+        """
+        Listeners of the channel, including those of all channels.
+        """
+        return self.listeners.get(channel, ()) + self.listeners.get(CAN.ALL_CHANNELS, ())
+
+    def _dispatch(self, listener, mailbox: Mailbox):
+        while True:
+            item = mailbox.get()
+            if item is None:  # closed
+                break
+            channel, (message, envelope) = item
+            self._call(listener, channel, message, envelope)
+
+    @staticmethod
+    def _needs_mailbox(listener) -> bool:
+        """
+        Whether the listener can only be reached through a mailbox (coroutines, 'messages' iterations).
+        """
+        return inspect.iscoroutinefunction(listener) or isinstance(listener, _Inbox)
+
+    async def _dispatch_async(self, listener, mailbox: Mailbox, wake: event_loop.Wake):
+        while not mailbox.closed:
+            wake.clear()
+            item = mailbox.get(timeout=0)
+            if item is None:
+                await wake.wait()
+                continue
+            channel, (message, envelope) = item
+            if envelope is not None and self.tracer is not None:
+                self.tracer.dispatched(channel, envelope, time.monotonic())
+            self._current.set(envelope)
+            try:
+                await listener(channel, message)
+            except Exception as e:
+                logger.error('{} failed to consume message: {}'.format(listener, e))
+
+    async def messages(self, channels: typing.Iterable):
+        """
+        Asynchronously iterate over the messages of the channels, in a coroutine on the process event loop.
+        The messages wait in a mailbox of the iteration, the channels' delivery policies apply while the consumer
+        is busy (e.g. a 'latest' channel yields the newest message),
+        the subscription ends when the consumer stops iterating (break, or the generator is closed).
+
+        Yields:
+            (channel, message)
+        """
+        inbox = _Inbox(self.channel_policies, asyncio.get_event_loop())
+        self.subscribe(list(channels), inbox)
+        try:
+            while not inbox.mailbox.closed:
+                inbox.wake.clear()
+                item = inbox.mailbox.get(timeout=0)
+                if item is None:
+                    await inbox.wake.wait()
+                    continue
+                channel, (message, envelope) = item
+                if envelope is not None and self.tracer is not None:
+                    self.tracer.dispatched(channel, envelope, time.monotonic())
+                self._current.set(envelope)
+                yield channel, message
+        finally:  # the consumer stopped iterating
+            self.unsubscribe(inbox)
+
+    def _call(self, listener, channel, message, envelope: Envelope = None):
+        if envelope is not None and self.tracer is not None:
+            self.tracer.dispatched(channel, envelope, time.monotonic())
+        self._current.set(envelope)
+        try:
+            listener(channel, message)
+        except Exception as e:
+            logger.error('{} failed to consume message: {}'.format(listener, e))
+
+    def message_origin(self) -> float:
+        """
+        Origin time of the message being handled by the calling listener ('on_message'),
+        None if not tracing.
+        """
+        envelope = self._current.get()
+        return envelope.origin if envelope is not None else None
+
+    def dropped(self) -> dict:
+        """
+        Number of messages dropped by the delivery policies.
+
+        Returns:
+            dict of (listener, channel) -> count
+        """
+        return {(listener, channel): count
+                for listener, mailbox in self.mailboxes.items()
+                for channel, count in mailbox.dropped.items()}
+
+    def _stop_dispatch(self):
+        with self._dispatch_lock:
+            for (listener, channel), count in self.dropped().items():
+                if count > 0:
+                    logger.info('{} dropped {} message(s) of channel {}.'.format(listener, count, channel))
+            for mailbox in self.mailboxes.values():
+                mailbox.close()
+            self.mailboxes.clear()
+
+            if self.tracer is not None:
+                self.tracer.dump(self.__class__.__name__)
+                self.tracer = None
+
+
+class _Inbox:
+    """
+    The mailbox of a 'CAN.messages' iteration, taken from by the iterating coroutine instead of a dispatcher.
+    """
+
+    def __init__(self, policies: dict, loop: asyncio.AbstractEventLoop):
+        self.wake = event_loop.Wake(loop)
+        self.mailbox = Mailbox(policies, notify=self.wake.set)
+
+    def __call__(self, channel, message):
+        raise TypeError('messages of a CAN.messages iteration are not dispatched.')
@@ -8,6 +8,12 @@ class Component(object):
     """
     Super class of all Car components.
     All components can receive interested messages and publish output messages.
+
+    'run' and 'on_message' can be coroutines ('async def'), the async components of a process
+    share one event loop thread ('utils.event_loop') instead of a thread each, e.g.:
+        async def run(self, stop_event):
+            while not await wait_stop(stop_event, self.interval):
+                self.publish_message(...)
     """
 
     def __init__(self):
@@ -19,7 +25,8 @@ class Component(object):
     def start(self) -> bool:
         """
         Start the component. If the component has long running job to do,
-        it should return True, and the 'run()' method will be run in separated thread/process.
+        it should return True, and the 'run()' method will be run in separated thread/process,
+        or on the process event loop if it is a coroutine.
         """
         return False
 
@@ -42,10 +49,13 @@ class Component(object):
         raise TypeError(
             "{} - subscribed to channel: '{}', but 'on_message' method not implemented!".format(self, channel))
 
-    def publish_message(self, *content):
+    def publish_message(self, *content, origin: float = None):
         """
         Publish message(s) to the pre-defined channel(s).
         Note: If publish to multiple channels, the content order should be the same as the output channels' name
+
+        Args:
+            origin: [Optional] origin time of the data the messages are derived from (see 'CAN.message_origin').
         """
         if self.can is None:
             raise ValueError("{} - can not publish message without 'CAN' defined in config file.".format(self))
@@ -55,5 +65,6 @@ class Component(object):
                             .format(self, len(content), len(self.publication)))
             self._channel_num_warned = True
 
-        for i in range(len(self.publication)):
-            self.can.publish(self.publication[i], content[i])
+        # at once, so grouped channels (see 'CAN') are sent together
+        self.can.publish_many([(self.publication[i], content[i]) for i in range(len(self.publication))],
+                              origin=origin, producer=self.__class__.__name__)
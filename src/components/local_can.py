@@ -0,0 +1,78 @@
+# coding=utf-8
+from components import CAN
+import types
+import typing
+import logging
+
+logger = logging.getLogger("LocalCAN")
+
+
+class LocalCAN(CAN):
+    """
+    In-process implementation of CAN, for components running as threads of the same interpreter.
+    Messages are passed to the listeners by reference, no serialization, no sockets.
+
+    By default messages go through each listener's mailbox and dispatch thread (see 'CAN'),
+    so a slow listener (e.g. the video recorder) does not stall the publisher or the other listeners.
+    With 'direct_dispatch', listeners are called in the publisher's thread, except the async ones.
+    """
+
+    def __init__(self, direct_dispatch: bool = False, channels: dict = None, trace: bool = False,
+                 groups: dict = None):
+        """
+        Args:
+            direct_dispatch: call the listeners directly in the publisher's thread.
+            channels: channel delivery policies, see 'CAN'.
+            trace: collect latency stats, see 'CAN'.
+            groups: groups of channels delivered atomically, see 'CAN'.
+        """
+        super(LocalCAN, self).__init__(channels, trace, groups)
+        self.direct_dispatch = direct_dispatch
+
+    def start(self) -> bool:
+        logger.info('Local CAN started.')
+        return True
+
+    def run(self, stop_event):
+        stop_event.wait()
+        self._stop_dispatch()
+
+    def publish(self, channel: str, message, origin: float = None, producer: str = None):
+        """
+        Publish a message to specified channel.
+        """
+        envelope = self._envelope(channel, origin, producer)
+        if self.direct_dispatch:
+            for listener in self._listeners(channel):
+                if listener not in self.mailboxes:
+                    self._call(listener, channel, message, envelope)
+        if not self.direct_dispatch or len(self.mailboxes) > 0:  # async listeners have mailboxes
+            self._deliver(channel, message, envelope, self._lane(channel, message))
+
+    def publish_many(self, messages: list, origin: float = None, producer: str = None):
+        """
+        Publish messages of different channels at once, the messages of a complete group are delivered atomically.
+        """
+        if self.direct_dispatch:  # already in order, in the publisher's thread
+            groups, others = [], messages
+        else:
+            groups, others = self._complete_groups(messages)
+        for group, group_messages in groups:
+            self._deliver_group(group, group_messages, self._envelope(group, origin, producer), CAN.CONTROL)
+        for channel, message in others:
+            self.publish(channel, message, origin=origin, producer=producer)
+
+    def subscribe(self, channels: typing.Iterable, listener: types.MethodType):
+        """
+        Subscribe to a channel.
+        """
+        logger.info('subscribe to {}'.format(channels))
+        if self.direct_dispatch and not self._needs_mailbox(listener):
+            for channel in channels:
+                self.listeners[channel] = self.listeners.get(channel, ()) + (listener,)
+        else:
+            self._add_listener(channels, listener)
+
+    def shutdown(self):
+        self._stop_dispatch()
+        logger.info('Local CAN shutdown.')
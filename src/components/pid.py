@@ -4,12 +4,18 @@ import cv2
 import logging
 import pickle
 import time
-from applications.cv_utils import undistort_and_tansform
+from threading import Event, Lock
+from applications.cv_utils import load_undistort_and_transform_maps
+from applications.line_detection import line_base_near
+from utils.frame import timestamp_of
+from utils.pid_controller import PIDController
 import os
 import numpy as np
 
 logger = logging.getLogger("PIDLineFollower")
 
+DEFAULT_PID_COEFFS = [-0.00361935681, -0.003901406179, -0.0003143881]  # Kp, Kd, Ki
+
 
 class PIDLineFollower(Component):
     """
@@ -26,7 +32,12 @@ class PIDLineFollower(Component):
                  steer_interval=0.1,
                  train_mode=False,
                  pid_params_file='./config/pid_coefficients.pkl',
-                 throttle=0.5
+                 throttle=0.5,
+                 max_frame_age=None,
+                 track_margin=None,
+                 track_min_pixels=10,
+                 min_period=None,
+                 max_period=None
                  ):
         """
         Args:
@@ -34,35 +45,60 @@ class PIDLineFollower(Component):
             calibration_result: calibration result pickle file.
             camera_offset: camera offset regarding to the image horizontal center, can be negative(on the left)
             white_threshold: pixels smaller than this value will be marked as the black line.
-            steer_interval: the interval between each steering control
+            steer_interval: the nominal interval between each steering control, the PID coefficients are tuned for,
+                the steering is computed from the real time between the frames.
             train_mode: whether training the PID params.
-            pid_params_file: where to save(under train mode) or load the PID params.
+            pid_params_file: where to save(under train mode) or load the PID params,
+                see 'applications.pid_tuner' to tune them offline.
+            max_frame_age: [Optional] skip camera frames captured more than that many seconds ago.
+            track_margin: [Optional] tracking mode, search the line within that many pixels around the last position,
+                fall back to searching the whole roi when not confident.
+            track_min_pixels: (tracking mode) minimum line pixels in the found column to be confident.
+            min_period: [Optional] minimum time between two steering controls, by default steer on every new frame.
+            max_period: [Optional] the deadline of a steering control after the previous one, steer_interval by default.
+                Without a new frame by then, the car stops until the next one, both count as missed deadlines.
         """
         super(PIDLineFollower, self).__init__()
         with open(calibration_result, 'br') as f:
             self.c_mtx, self.c_dist, self.c_corners, self.c_img_size = pickle.load(f)
+        self.calibration_result = calibration_result
+        self.remap_size = None  # image size of the remap tables
+        self.remap_tables = None
         self.roi = roi
         self.camera_offset = camera_offset
         self.white_threshold = white_threshold
         self.steer_interval = steer_interval
+        self.min_period = min_period or 0.0
+        self.max_period = max_period or steer_interval
         self.train_mode = train_mode
         self.pid_params_file = pid_params_file
 
         # internal state
         self.image = None
+        self.image_origin = None  # capture time of the image, if known
+        self.image_lock = Lock()  # image and image_origin are swapped together
+        self.frame_ready = Event()  # a new image arrived
+        self.started = Event()  # set while moving
+        self.last_control = None  # time of the last steering control
+        self.last_origin = None  # capture time of the image of the last steering control
+        self.missed_deadlines = 0
+        self.max_frame_age = max_frame_age
+        self.stale_frames = 0
+        self.track_margin = track_margin
+        self.track_min_pixels = track_min_pixels
+        self.last_line = None  # line position of the last frame, when tracking
+        self.tracked_frames = 0
         self.moving = False
         self.last_not_found = 0
 
-        # cross track error
-        self.int_cte = 0  # integral cross track error
-        self.prev_cte = 0  # previous cross track error
-
         if os.path.exists(pid_params_file):
             with open(pid_params_file, 'br') as f:
                 self.pid_coeffs = pickle.load(f)
         else:
             # some default params
-            self.pid_coeffs = [-0.00361935681, -0.003901406179, -0.0003143881]
+            self.pid_coeffs = DEFAULT_PID_COEFFS
+        self.pid_coeffs = np.array(self.pid_coeffs, dtype=np.float64)  # tuned in place in train mode
+        self.controller = PIDController(self.pid_coeffs, steer_interval)
 
         if train_mode:
             self.d_coeffs = self.pid_coeffs / 10.0
@@ -78,11 +114,22 @@ class PIDLineFollower(Component):
         self.throttle = throttle
         self.throttle_scale = 1.0
 
-    def _preprocess_image(self, img):
-        undist = undistort_and_tansform(img, self.c_mtx, self.c_dist, self.c_corners, self.c_img_size)
+    def _prepare_remap(self, size: tuple):
+        """
+        Build the remap tables of the roi for an image size (width, height), if not done yet.
+        """
+        if self.remap_size != size:
+            map1, map2 = load_undistort_and_transform_maps(self.calibration_result, size)
+            roi_top_left, roi_bottom_right = self.roi[0], self.roi[1]
+            rows = slice(roi_top_left[1], roi_bottom_right[1])
+            cols = slice(roi_top_left[0], roi_bottom_right[0])
+            self.remap_tables = np.ascontiguousarray(map1[rows, cols]), np.ascontiguousarray(map2[rows, cols])
+            self.remap_size = size
 
-        roi_top_left, roi_bottom_right = self.roi[0], self.roi[1]
-        roi = undist[roi_top_left[1]:roi_bottom_right[1], roi_top_left[0]:roi_bottom_right[0]]
+    def _preprocess_image(self, img):
+        # undistort and bird's view transform of the roi only, in one pass, the tables are built once per image size
+        self._prepare_remap((img.shape[1], img.shape[0]))
+        roi = cv2.remap(img, self.remap_tables[0], self.remap_tables[1], cv2.INTER_LINEAR)
 
         #cv2.imwrite('./image_out_roi_{}.png'.format(time.time()), roi)
         gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
@@ -97,16 +144,31 @@ class PIDLineFollower(Component):
         Returns:
             line_position, car_position
         """
-        binary = self._preprocess_image(img)
+        return self._locate_line(self._preprocess_image(img))
+
+    def _locate_line(self, binary) -> tuple:
+        """
+        Find the line in the preprocessed (binary) roi, see '_find_line'.
+        """
         # car at the middle
         car_position = binary.shape[1] // 2 - self.camera_offset
 
-        histogram = np.sum(binary, axis=0)
-        line_base = np.argmax(histogram)
-
-        # Create an output image to draw on and visualize the result
+        line_base = None
+        if self.track_margin is not None and self.last_line is not None:
+            line_base, pixels = line_base_near(binary, self.last_line, self.track_margin)
+            if pixels < self.track_min_pixels:  # lost, search the whole roi
+                line_base = None
+            else:
+                self.tracked_frames += 1
+        if line_base is None:
+            histogram = np.sum(binary, axis=0)
+            line_base = np.argmax(histogram)
+        if self.track_margin is not None:
+            self.last_line = line_base if line_base > 0 else None
+
+        # Create an output image to draw on and visualize the result, only if anyone is watching
         image_out = None
-        if len(self.publication) == 3:
+        if len(self.publication) == 3 and self.can.has_subscribers(self.publication[2]):
             image_out = np.dstack((binary, binary, binary))
             cv2.circle(image_out, (line_base, binary.shape[0] - 2), 3, (0, 255, 0), thickness=2)
 
@@ -174,50 +236,12 @@ class PIDLineFollower(Component):
         self.train_sum_error = 0
         self.training_epoch += 1
 
-    def _pid_steering(self, cte):
+    def _pid_steering(self, cte, dt=None):
         """
-        Use the equation: new_steering = Kp * cte + Ki * cte_integrational + Kd * cte_differential
-        to calculate the new steering.
+        Steering of the cross track error, dt seconds after the previous one,
+        see 'utils.pid_controller.PIDController'.
         """
-        diff_cte = cte - self.prev_cte
-        self.prev_cte = cte
-        self.int_cte += cte
-
-        # proportional
-        pid_p = self.pid_coeffs[0] * cte
-
-        # differential
-        pid_d = self.pid_coeffs[1] * diff_cte
-
-        # integrational
-        if abs(cte) <= 10:  # anti integerator windup (over shooting)
-            self.int_cte = 0
-
-        pid_i = self.pid_coeffs[2] * self.int_cte
-
-        # anti windup via dynamic integrator clamping
-        int_limit_max = 0.0
-        int_limit_min = 0.0
-        if pid_p < 1:
-            int_limit_max = 1 - pid_p
-        if pid_p > -1:
-            int_limit_min = -1 - pid_p
-
-        if pid_i > int_limit_max:
-            pid_i = int_limit_max
-        elif pid_i < int_limit_min:
-            pid_i = int_limit_min
-
-        # sum up
-        steer = pid_p + pid_d + pid_i
-
-        # apply limits
-        if steer < -1:
-            return -1
-        elif steer > 1:
-            return 1
-        else:
-            return steer
+        return self.controller.steer(cte, dt)
 
     def start(self) -> bool:
         # check subscription
@@ -227,43 +251,100 @@ class PIDLineFollower(Component):
         return True
 
     def shutdown(self):
-        pass
+        if self.track_margin is not None:
+            logger.info('Tracked the line in {} frame(s).'.format(self.tracked_frames))
+        if self.stale_frames > 0:
+            logger.info('Skipped {} stale frame(s).'.format(self.stale_frames))
+        if self.missed_deadlines > 0:
+            logger.info('Missed {} steering deadline(s) of {}s.'.format(self.missed_deadlines, self.max_period))
 
     def run(self, stop_event):
+        """
+        Steer on every new frame, at most every 'min_period', expecting one within 'max_period'.
+        """
         while not stop_event.is_set():
-            if self.image is not None and self.moving:
-                line, car, image_out = self._find_line(self.image)
-                self.image = None
-                if line > 0:
-                    cte = PIDLineFollower._cte(line, car)
-                    steering = self._pid_steering(cte)
-
-                    if self.train_mode:
-                        self.training_step += 1
-                        self.train_sum_error += self.prev_cte ** 2
-
-                    # output some info on the output image
-                    print(image_out.shape)
-                    cv2.line(image_out, (car, 0), (car, image_out.shape[0] - 1), (0, 0, 255), thickness=1)
-                    cv2.putText(image_out, 'cte: {:.2f}'.format(cte),
-                                (30, int(image_out.shape[0]/2)),
-                                cv2.FONT_HERSHEY_SIMPLEX,
-                                1, (0, 255, 0), thickness=1)
-                    cv2.putText(image_out, 'steer: {:.2f}'.format(steering),
-                                (30, int(image_out.shape[0]/2 + 25)),
-                                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), thickness=1)
-                    #cv2.imwrite('./image_out_{}.png'.format(time.time()), image_out)
-                    self.publish_message(steering, self.throttle * self.throttle_scale, image_out)
-                else:
+            if not self.moving:
+                self.last_control = self.last_origin = None
+                self.publish_message(0, 0, None)
+                self.started.wait(self.max_period)
+                continue
+
+            deadline = self.last_control + self.max_period if self.last_control is not None else None
+            timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else self.max_period
+            ready = self.frame_ready.wait(timeout)
+            if stop_event.is_set() or not self.moving:
+                continue
+            with self.image_lock:  # take the frame and its origin together
+                self.frame_ready.clear()
+                image, origin = self.image, self.image_origin
+                self.image, self.image_origin = None, None
+
+            if image is None:
+                if not ready and deadline is not None and time.monotonic() >= deadline:
+                    # no frame by the deadline, stop until the next one
+                    self._missed_deadline('no frame')
+                    self.last_control = time.monotonic()
+                    self.publish_message(0, 0, None)
+                elif deadline is None:  # no frame yet
                     self.publish_message(0, 0, None)
+            elif (self.max_frame_age is not None and origin is not None
+                    and time.monotonic() - origin > self.max_frame_age):
+                # stale, keep the last steering until a fresh frame
+                self.stale_frames += 1
             else:
-                self.publish_message(0, 0, None)
+                self._steer(image, origin)
+
+                if self.min_period > 0:
+                    stop_event.wait(max(0.0, self.last_control + self.min_period - time.monotonic()))
+
+    def _steer(self, image, origin):
+        """
+        Steer from a frame captured at origin (if known).
+        """
+        line, car, image_out = self._find_line(image)
+        now = time.monotonic()
+        if self.last_control is not None and now - self.last_control > self.max_period:
+            self._missed_deadline('late by {:.1f}ms'.format((now - self.last_control - self.max_period) * 1000))
 
-            time.sleep(self.steer_interval)
+        if origin is not None and self.last_origin is not None:
+            dt = origin - self.last_origin
+        else:
+            dt = now - self.last_control if self.last_control is not None else None
+        self.last_control, self.last_origin = now, origin
+
+        if line > 0:
+            cte = PIDLineFollower._cte(line, car)
+            steering = self._pid_steering(cte, dt)
+
+            if self.train_mode:
+                self.training_step += 1
+                self.train_sum_error += self.controller.prev_cte ** 2
+
+            # output some info on the output image
+            if image_out is not None:
+                cv2.line(image_out, (car, 0), (car, image_out.shape[0] - 1), (0, 0, 255), thickness=1)
+                cv2.putText(image_out, 'cte: {:.2f}'.format(cte),
+                            (30, int(image_out.shape[0]/2)),
+                            cv2.FONT_HERSHEY_SIMPLEX,
+                            1, (0, 255, 0), thickness=1)
+                cv2.putText(image_out, 'steer: {:.2f}'.format(steering),
+                            (30, int(image_out.shape[0]/2 + 25)),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), thickness=1)
+            #cv2.imwrite('./image_out_{}.png'.format(time.time()), image_out)
+            self.publish_message(steering, self.throttle * self.throttle_scale, image_out, origin=origin)
+        else:
+            self.publish_message(0, 0, None)
+
+    def _missed_deadline(self, reason: str):
+        self.missed_deadlines += 1
+        logger.debug('Missed steering deadline: {}.'.format(reason))
 
     def on_message(self, channel, content):
         if channel == self.subscription[0]:  # camera image
-            self.image = content
+            origin = timestamp_of(content) or self.can.message_origin()
+            with self.image_lock:
+                self.image, self.image_origin = content, origin
+                self.frame_ready.set()
         elif channel == self.subscription[1]:  # start/stop
             move = bool(content)
             if self.train_mode:
@@ -271,5 +352,9 @@ class PIDLineFollower(Component):
                     if not move:  # finish one training iteration
                         self._twiddle_pid_params()
             self.moving = move
+            if move:
+                self.started.set()
+            else:
+                self.started.clear()
         elif channel == self.subscription[2]:  # throttle scale
             self.throttle_scale *= float(content)
@@ -1,5 +1,6 @@
 # coding=utf-8
 from components import Component
+from utils.frame import timestamp_of
 import cv2
 import logging
 import time
@@ -12,10 +13,19 @@ class VideoRecorder(Component):
     A simple video recorder.
 
     subscriptions: camera input, record switch
+
+    Frames with a capture timestamp ('utils.frame.Frame') are written from the very first one at 'fps',
+    a frame is repeated or skipped according to its timestamp, so the video plays in real time.
+    For bare arrays the fps is measured during the first second.
     """
 
     def __init__(self, path: str = None, name: str = None,
-                 auto_start: bool = False):
+                 auto_start: bool = False,
+                 fps: float = 20.0):
+        """
+        Args:
+            fps: frame rate of the video, of timestamped frames.
+        """
         super(VideoRecorder, self).__init__()
         logger.info('VideoRecorder will save video to {}/{}'.format(path or '.', name or 'capture.avi'))
         self.path = path
@@ -28,8 +38,15 @@ class VideoRecorder(Component):
         self.fps_set = False
         self.writer = None
 
+        # timestamped frames
+        self.video_fps = fps
+        self.record_start = None  # timestamp of the first video frame of the current recording
+        self.written = 0  # video frames
+
     def on_message(self, channel, content):
-        if channel == self.subscription[0] and content is not None:
+        if channel == self.subscription[0] and content is not None and timestamp_of(content) is not None:
+            self._write_timed(content)
+        elif channel == self.subscription[0] and content is not None:
             self.capture = content
 
             if self.start_time == 0:
@@ -52,6 +69,27 @@ class VideoRecorder(Component):
 
         elif channel == self.subscription[1]:
             self.record = content
+            if not self.record:
+                self.record_start = None
+
+    def _write_timed(self, frame):
+        if self.writer is None:
+            logger.info('Recording at {} fps, width: {}, height: {}'.format(self.video_fps, frame.shape[1],
+                                                                           frame.shape[0]))
+            self.writer = cv2.VideoWriter((self.path or '.') + '/' + (self.name or 'capture.avi'),
+                                          cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'),
+                                          self.video_fps,
+                                          (frame.shape[1], frame.shape[0]))
+        if not self.record:
+            return
+
+        if self.record_start is None:  # (re)started recording, continue the video
+            self.record_start = frame.timestamp - self.written / self.video_fps
+        # video frames up to this frame's time
+        slots = int(round((frame.timestamp - self.record_start) * self.video_fps)) + 1 - self.written
+        for _ in range(slots):
+            self.writer.write(frame)
+        self.written += max(slots, 0)
 
     def shutdown(self):
         logger.info('Stopping VideoRecorder')
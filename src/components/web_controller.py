@@ -52,7 +52,10 @@ class WebController(Component):
                 if self.image is not None and (time.time() - self.last_stream_time) > (1.0 / self.stream_frame_rate):
                     self.last_stream_time = time.time()
 
-                    frame = cv2.resize(self.image, (480, 270))
+                    frame = self.image
+                    if frame.shape[1] != self.stream_width or frame.shape[0] != self.stream_height:
+                        # not a stream sized camera variant (see 'Camera')
+                        frame = cv2.resize(frame, (self.stream_width, self.stream_height))
                     encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 20]
                     _, buffer = cv2.imencode('.jpg', frame, encode_param)
                     captured = buffer.tostring()
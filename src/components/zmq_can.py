@@ -2,9 +2,17 @@
 from components import CAN
 import zmq
 import types
-import pickle
 import typing
 import logging
+import os
+import socket
+import time
+import struct
+from threading import Thread, Lock
+from utils import can_codec
+from utils.shm_ring import SharedFrameRing, ring_name
+from utils.can_trace import pack_envelope, unpack_envelope
+import numpy as np
 
 logger = logging.getLogger("ZmqCAN")
 
@@ -13,33 +21,169 @@ class ZmqCAN(CAN):
     """
     The ZMQ implementation of CAN.
     Server side: act as a broker to receive and broadcast messages. PUB + PULL
+        The broker is a native ZMQ proxy (PULL -> PUB), messages never go through the Python interpreter.
+        All the traffic is also copied to a capture PUB socket, to be tapped for stats (see 'traffic_stats').
+        There is a separated set of sockets and proxy per lane (control, bulk, see 'CAN'),
+        so steering/throttle messages never queue behind image frames.
     Client side: subscribe to server side and push messages to server side. SUB + PUSH
+        One client is shared by all the components of a process (see 'process_client'),
+        each message arrives once per process and is dispatched to the local listeners.
+        The receiving thread blocks until a message arrives, or it is woken up (stop, new subscription).
+        The control lane is always received first.
+
+    Message wire format: [channel, header, payload(, envelope)], see 'utils.can_codec' and 'utils.can_trace'.
+    Typed channels (see 'CAN') are packed with struct instead of pickle, a complete group published with
+    'publish_many' is sent as one message on the group's topic.
+    Image frames (numpy arrays) are sent and forwarded without copying or pickling.
+    With 'shared_memory' (used in process parallel mode), large arrays are written to a shared memory ring
+    ('utils.shm_ring') and only the ring slot is sent, subscribers copy the frame out of the ring.
+
+    Each client announces the listener counts of its process on a reserved channel ('CAN.SUBSCRIPTIONS'),
+    on subscription changes, to newly seen clients and every 'announce_interval' seconds,
+    a client not heard from for 3 intervals is forgotten. 'has_subscribers' sums up all the processes,
+    it is True for any channel until the announcements of the other processes had time to arrive.
+
+    Transports:
+        tcp: tcp://<host>:<port>, the default, also reachable from other hosts.
+        ipc: Unix domain sockets, skip the TCP stack when all processes are on the same board.
+        inproc: within one process only, skip the kernel completely (used for thread parallel mode).
     """
+    LANES = (CAN.CONTROL, CAN.BULK)  # in receiving priority
+    _clients = {}  # pid -> client shared by the components of the process
+    _clients_lock = Lock()
 
-    def __init__(self, server_mode: bool):
-        super(CAN, self).__init__()
+    def __init__(self, server_mode: bool,
+                 shared_memory: bool = False,
+                 shm_slots: int = 8,
+                 shm_min_size: int = 65536,
+                 channels: dict = None,
+                 capture: bool = True,
+                 transport: str = 'tcp',
+                 host: str = 'localhost',
+                 port: int = 6000,
+                 ipc_dir: str = '/tmp',
+                 trace: bool = False,
+                 groups: dict = None,
+                 announce_interval: float = 1.0):
+        """
+        Args:
+            server_mode: run as the broker, or as a client.
+            shared_memory: (client) publish large numpy arrays through shared memory rings.
+            shm_slots: number of frames in each shared memory ring,
+                a subscriber falling behind more than that many frames will drop frames.
+            shm_min_size: minimum array size in bytes to go through shared memory.
+            channels: (client) channel delivery policies, see 'CAN'.
+            capture: (server) copy all traffic to the capture socket.
+            transport: 'tcp', 'ipc' or 'inproc'.
+            host: (tcp client) host of the broker.
+            port: (tcp) the broker's control lane PUB port, the control lane PULL and capture ports are the next two,
+                followed by the bulk lane's PUB, PULL and capture ports.
+            ipc_dir: (ipc) where to create the socket files.
+            trace: (client) attach envelopes to messages and collect latency stats, see 'CAN'.
+            groups: (client) groups of typed channels, see 'CAN'.
+            announce_interval: (client) seconds between the announcements of the subscriptions of the process.
+        """
+        super(ZmqCAN, self).__init__(channels, trace, groups)
         context = zmq.Context.instance()
+        self._endpoints = ZmqCAN.endpoints(transport, host, port, ipc_dir)
+        bind = {name: endpoint[0] for name, endpoint in self._endpoints.items()}
+        connect = {name: endpoint[1] for name, endpoint in self._endpoints.items()}
+
+        # sockets of each lane
+        self.pub, self.pull, self.capture, self.control, self.terminate = {}, {}, {}, {}, {}
+        self.sub, self.push = {}, {}
 
         self.server_mode = server_mode
-        if server_mode:  # server mode
-            pub = context.socket(zmq.PUB)
-            pub.bind("tcp://*:6000")
-            self.pub = pub
-
-            pull = context.socket(zmq.PULL)
-            pull.bind("tcp://*:6001")
-            self.pull = pull
-        else:  # client mode
-            sub = context.socket(zmq.SUB)
-            sub.connect("tcp://localhost:6000")
-            self.sub = sub
+        for lane in ZmqCAN.LANES:
+            prefix = '' if lane == CAN.CONTROL else lane + '_'
+            if server_mode:  # server mode
+                pub = context.socket(zmq.PUB)
+                pub.bind(bind[prefix + 'backend'])
+                self.pub[lane] = pub
+
+                pull = context.socket(zmq.PULL)
+                pull.bind(bind[prefix + 'frontend'])
+                self.pull[lane] = pull
+
+                self.capture[lane] = None
+                if capture:
+                    self.capture[lane] = context.socket(zmq.PUB)
+                    self.capture[lane].bind(bind[prefix + 'capture'])
+
+                # to terminate the proxy
+                control_endpoint = 'inproc://zmq_can-control-{}-{}'.format(lane, id(self))
+                self.control[lane] = context.socket(zmq.PAIR)
+                self.control[lane].bind(control_endpoint)
+                self.terminate[lane] = context.socket(zmq.PAIR)
+                self.terminate[lane].connect(control_endpoint)
+            else:  # client mode
+                sub = context.socket(zmq.SUB)
+                sub.connect(connect[prefix + 'backend'])
+                self.sub[lane] = sub
 
+            # the server's PUB socket belongs to the proxy, messages published by the server go through the proxy
             push = context.socket(zmq.PUSH)
-            push.connect("tcp://localhost:6001")
-            self.push = push
+            push.connect(connect[prefix + 'frontend'])
+            self.push[lane] = push
 
-            # dict of client listeners
-            self.listeners = {}
+        if not server_mode:
+            # to wake up the receiving thread
+            self._wake_r, self._wake_w = os.pipe()
+            os.set_blocking(self._wake_r, False)
+            os.set_blocking(self._wake_w, False)
+
+        # shared memory
+        self.shared_memory = shared_memory
+        self.shm_slots = shm_slots
+        self.shm_min_size = shm_min_size
+        self.shm_writers = {}  # channel -> ring
+        self.shm_readers = {}  # ring name -> ring
+        self.shm_dropped = 0
+        self._shm_generation = 0
+
+        # the client is shared by the component threads, sockets are not thread safe
+        self._send_locks = {lane: Lock() for lane in ZmqCAN.LANES}
+        self._sub_lock = Lock()
+        self._new_subscriptions = []  # to be subscribed by the run thread
+
+        # subscriber counts of the other processes
+        self.announce_interval = announce_interval
+        self.client_id = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), id(self))
+        self._remote = {}  # client id -> (dict of channel -> count, time heard)
+        self._remote_counts = {}  # channel -> count, of all the other clients
+        self._next_announce = 0.0
+        self._counts_ready = None  # time the counts are complete, None before the client runs
+
+    @staticmethod
+    def endpoints(transport: str = 'tcp', host: str = 'localhost', port: int = 6000, ipc_dir: str = '/tmp') -> dict:
+        """
+        Returns:
+            dict of socket -> (bind endpoint, connect endpoint),
+            sockets: backend(PUB), frontend(PULL), capture(PUB), bulk_backend, bulk_frontend, bulk_capture
+        """
+        ports = {'backend': port, 'frontend': port + 1, 'capture': port + 2,
+                 'bulk_backend': port + 3, 'bulk_frontend': port + 4, 'bulk_capture': port + 5}
+        if transport == 'tcp':
+            return {name: ('tcp://*:{}'.format(p), 'tcp://{}:{}'.format(host, p)) for name, p in ports.items()}
+        elif transport == 'ipc':
+            return {name: ('ipc://{}/mycar-can-{}'.format(ipc_dir, p),) * 2 for name, p in ports.items()}
+        elif transport == 'inproc':
+            return {name: ('inproc://mycar-can-{}'.format(p),) * 2 for name, p in ports.items()}
+        raise ValueError("unknown ZmqCAN transport '{}', should be one of: tcp, ipc, inproc".format(transport))
+
+    @staticmethod
+    def process_client(can_args: dict, stop_event) -> 'ZmqCAN':
+        """
+        Get the client shared by all the components of the current process, created and started on first use.
+        """
+        with ZmqCAN._clients_lock:
+            client = ZmqCAN._clients.get(os.getpid())
+            if client is None:
+                client = ZmqCAN(**dict(can_args or {}, server_mode=False))
+                client.start()
+                Thread(name='ZmqCAN_client-run', target=client.run, args=(stop_event,), daemon=True).start()
+                ZmqCAN._clients[os.getpid()] = client
+            return client
 
     def start(self) -> bool:
         logger.info("ZMQ ({}) CAN started.".format('server' if self.server_mode else 'client'))
@@ -47,45 +191,291 @@ class ZmqCAN(CAN):
 
     def run(self, stop_event):
         if self.server_mode:
-            while not stop_event.is_set():
-                try:
-                    received = self.pull.recv_multipart()
-                    self.pub.send_multipart(received)
-                except Exception as e:
-                    logger.error('Failed to broadcast message', e)
+            Thread(name='ZmqCAN-broker-stop', target=self._stop_proxy, args=(stop_event,), daemon=True).start()
+            bulk = Thread(name='ZmqCAN-broker-bulk', target=self._proxy, args=(CAN.BULK,), daemon=True)
+            bulk.start()
+            self._proxy(CAN.CONTROL)
+            bulk.join()
+            logger.info('Broker stopped.')
         else:  # client
+            Thread(name='ZmqCAN_client-stop', target=self._wake_on_stop, args=(stop_event,), daemon=True).start()
+            poller = zmq.Poller()
+            for sub in self.sub.values():
+                poller.register(sub, zmq.POLLIN)
+            poller.register(self._wake_r, zmq.POLLIN)
+            self._start_announcing()
             while not stop_event.is_set():
                 try:
-                    events = self.sub.poll(timeout=0.005)
-                    for i in range(events):
-                        multipart = self.sub.recv_multipart()
-                        channel = multipart[0].decode()
-                        message = pickle.loads(multipart[1])
-                        for listener in self.listeners[channel]:
+                    self._apply_subscriptions()
+                    poller.poll(int(self._announce() * 1000) + 1)  # until a message, a wake up or the next announcement
+                    while True:  # drain the sockets, a control message is always received before the next bulk one
+                        for lane in ZmqCAN.LANES:
                             try:
-                                listener(channel, message)
-                            except Exception as e1:
-                                logger.error('{} failed to consume message'.format(listener), e1)
+                                multipart = self.sub[lane].recv_multipart(zmq.NOBLOCK, copy=False)
+                            except zmq.Again:
+                                continue
+                            self._on_multipart(multipart, lane)
+                            break
+                        else:
+                            break
                 except Exception as e:
-                    logger.error('Failed to consume message', e)
+                    logger.error('Failed to consume message: {}'.format(e))
+            self._stop_announcing()
+            self._stop_dispatch()
+
+    def _proxy(self, lane: str):
+        try:
+            zmq.proxy_steerable(self.pull[lane], self.pub[lane], self.capture[lane], self.control[lane])
+        except zmq.ZMQError as e:
+            logger.error('Broker ({}) stopped: {}'.format(lane, e))
+
+    def _on_multipart(self, multipart, lane: str):
+        channel = can_codec.channel_of(multipart[0])
+        try:
+            message = can_codec.decode(multipart[1:3], self._shm_reader)
+        except LookupError as e:
+            self.shm_dropped += 1
+            logger.debug(e)
+            return
+        if channel == CAN.SUBSCRIPTIONS:
+            self._on_announcement(*message)
+            return
+        envelope = unpack_envelope(multipart[3].buffer) if len(multipart) > 3 else None
+        if channel in self.groups:
+            self._deliver_group(channel, message, envelope, lane)
+        else:
+            self._deliver(channel, message, envelope, lane)
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'w')
+        except (BlockingIOError, OSError):  # already woken up, or closed
+            pass
+
+    def _wake_on_stop(self, stop_event):
+        stop_event.wait()
+        self._wake()
 
-    def publish(self, channel: str, message):
+    def publish(self, channel: str, message, origin: float = None, producer: str = None):
         """
         Publish a message to specified channel.
         """
-        if self.server_mode:
-            self.pub.send_multipart([channel.encode(), pickle.dumps(message)])
-        else:
-            self.push.send_multipart([channel.encode(), pickle.dumps(message)])
+        envelope = self._envelope(channel, origin, producer)
+        lane = self._lane(channel, message)
+        with self._send_locks[lane]:
+            if (self.shared_memory and isinstance(message, np.ndarray) and message.nbytes >= self.shm_min_size
+                    and message.dtype.kind in 'biuf'):
+                ring = self._shm_writer(channel, message.nbytes)
+                slot, seq = ring.write(message)
+                frames = [can_codec.topic(channel)] + can_codec.encode_shared(ring.name, slot, seq, message)
+            else:
+                frames = [can_codec.topic(channel)] + self._encode(channel, message)
+            self._send(lane, frames, envelope)
+
+    def publish_many(self, messages: list, origin: float = None, producer: str = None):
+        """
+        Publish messages of different channels at once, the messages of a complete group are sent as one.
+        """
+        groups, others = self._complete_groups(messages)
+        for group, group_messages in groups:
+            try:
+                frames = can_codec.encode_group([self.channel_types[c] for c in self.groups[group]], group_messages)
+            except (struct.error, TypeError):  # e.g. None, send them one by one
+                others.extend(zip(self.groups[group], group_messages))
+                continue
+            envelope = self._envelope(group, origin, producer)
+            with self._send_locks[CAN.CONTROL]:
+                self._send(CAN.CONTROL, [can_codec.topic(group)] + frames, envelope)
+        for channel, message in others:
+            self.publish(channel, message, origin=origin, producer=producer)
+
+    def _encode(self, channel: str, message) -> list:
+        fmt = self.channel_types.get(channel)
+        if fmt is not None:
+            try:
+                return can_codec.encode_typed(fmt, message)
+            except (struct.error, TypeError):  # e.g. None
+                pass
+        return can_codec.encode(message)
+
+    def _send(self, lane: str, frames: list, envelope=None):
+        if envelope is not None:
+            frames.append(pack_envelope(envelope))
+        self.push[lane].send_multipart(frames, copy=False)
 
     def subscribe(self, channels: typing.Iterable, listener: types.MethodType):
         """
         Subscribe to a channel.
         """
         logger.info('subscribe to {}'.format(channels))
-        for channel in channels:
-            if channel not in self.listeners:
-                self.listeners[channel] = [listener]
-            else:
-                self.listeners[channel].append(listener)
-            self.sub.subscribe(channel)
+        self._add_listener(channels, listener)
+        with self._sub_lock:
+            self._new_subscriptions.extend(channels)
+        self._wake()
+
+    def unsubscribe(self, listener: types.MethodType):
+        """
+        Remove a listener from all its channels, the other processes learn the new counts right away.
+        """
+        super(ZmqCAN, self).unsubscribe(listener)
+        self._next_announce = 0.0
+        self._wake()
+
+    def _apply_subscriptions(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        with self._sub_lock:
+            channels, self._new_subscriptions = self._new_subscriptions, []
+        if len(channels) > 0:
+            self._next_announce = 0.0  # now
+        topics = set(channels) | {self.channel_groups[c] for c in channels if c in self.channel_groups}
+        for topic in topics:
+            for sub in self.sub.values():  # the lane is decided by the publisher
+                sub.subscribe(b'' if topic == CAN.ALL_CHANNELS else can_codec.topic(topic))
+
+    def subscriber_counts(self) -> dict:
+        """
+        Number of listeners of each channel, in all the processes.
+        """
+        counts = super(ZmqCAN, self).subscriber_counts()
+        for channel, count in self._remote_counts.items():
+            counts[channel] = counts.get(channel, 0) + count
+        return counts
+
+    def has_subscribers(self, channel: str) -> bool:
+        if self._counts_ready is None or time.monotonic() < self._counts_ready:  # not known yet
+            return True
+        return super(ZmqCAN, self).has_subscribers(channel)
+
+    def _start_announcing(self):
+        """
+        Receive the announcements of the other clients, the counts are complete after one interval.
+        """
+        self.sub[CAN.CONTROL].subscribe(can_codec.topic(CAN.SUBSCRIPTIONS))
+        self._next_announce = 0.0
+        self._counts_ready = time.monotonic() + self.announce_interval * 1.5
+
+    def _announce(self) -> float:
+        """
+        Announce the listener counts of the process if due, forget the clients not heard from for 3 intervals.
+
+        Returns:
+            seconds until the next announcement
+        """
+        now = time.monotonic()
+        if now >= self._next_announce:
+            self._send_announcement(super(ZmqCAN, self).subscriber_counts())
+            self._next_announce = now + self.announce_interval
+            stale = [client for client, (_, heard) in self._remote.items() if now - heard > 3 * self.announce_interval]
+            for client in stale:
+                logger.info('Client {} not heard from, forgot its subscriptions.'.format(client))
+                self._on_announcement(client, None)
+        return max(0.0, self._next_announce - now)
+
+    def _stop_announcing(self):
+        try:
+            self._send_announcement(None)  # gone
+        except zmq.ZMQError as e:
+            logger.debug('Failed to announce the end of the subscriptions: {}'.format(e))
+
+    def _send_announcement(self, counts: dict):
+        frames = [can_codec.topic(CAN.SUBSCRIPTIONS)] + can_codec.encode((self.client_id, counts))
+        with self._send_locks[CAN.CONTROL]:
+            self._send(CAN.CONTROL, frames)
+
+    def _on_announcement(self, client: str, counts: dict):
+        """
+        Update the subscriber counts of a client, counts None if it is gone.
+        """
+        if client == self.client_id:
+            return
+        remote = dict(self._remote)  # copy on write, read without lock
+        if counts is None:
+            remote.pop(client, None)
+        else:
+            if client not in remote:  # a new client, let it know this one's subscriptions soon
+                self._next_announce = 0.0
+            remote[client] = (counts, time.monotonic())
+        totals = {}
+        for client_counts, _ in remote.values():
+            for channel, count in client_counts.items():
+                totals[channel] = totals.get(channel, 0) + count
+        self._remote, self._remote_counts = remote, totals
+
+    def _stop_proxy(self, stop_event):
+        stop_event.wait()
+        for terminate in self.terminate.values():
+            terminate.send(b'TERMINATE')
+
+    @staticmethod
+    def traffic_stats(duration: float = 5.0,
+                      transport: str = 'tcp',
+                      host: str = 'localhost',
+                      port: int = 6000,
+                      ipc_dir: str = '/tmp',
+                      capture_endpoints: typing.Iterable = None) -> dict:
+        """
+        Tap the broker's capture sockets for a while, and count the traffic of each channel.
+
+        Args:
+            transport, host, port, ipc_dir: of the broker, see 'endpoints'.
+            capture_endpoints: [Optional] the capture sockets to connect to, instead of the broker's.
+
+        Returns:
+            dict of channel -> (messages per second, bytes per second)
+        """
+        if capture_endpoints is None:
+            endpoints = ZmqCAN.endpoints(transport, host, port, ipc_dir)
+            capture_endpoints = [endpoints['capture'][1], endpoints['bulk_capture'][1]]
+        tap = zmq.Context.instance().socket(zmq.SUB)
+        for endpoint in capture_endpoints:
+            tap.connect(endpoint)
+        tap.subscribe('')
+
+        stats = {}
+        start = time.time()
+        while time.time() - start < duration:
+            if tap.poll(timeout=100):
+                frames = tap.recv_multipart(copy=False)
+                channel = can_codec.channel_of(frames[0])
+                count, size = stats.get(channel, (0, 0))
+                stats[channel] = (count + 1, size + sum(len(f) for f in frames))
+        tap.close()
+
+        elapsed = time.time() - start
+        return {channel: (count / elapsed, size / elapsed) for channel, (count, size) in stats.items()}
+
+    def _shm_writer(self, channel: str, size: int) -> SharedFrameRing:
+        ring = self.shm_writers.get(channel)
+        if ring is None or ring.slot_size < size:
+            if ring is not None:  # frame size changed, readers will attach to the new ring
+                ring.close(unlink=True)
+            self._shm_generation += 1
+            ring = SharedFrameRing.create(ring_name(channel, self._shm_generation), size, self.shm_slots)
+            self.shm_writers[channel] = ring
+        return ring
+
+    def _shm_reader(self, name: str) -> SharedFrameRing:
+        ring = self.shm_readers.get(name)
+        if ring is None:
+            ring = SharedFrameRing.attach(name)
+            self.shm_readers[name] = ring
+        return ring
+
+    def shutdown(self):
+        self._stop_dispatch()
+        if not self.server_mode:
+            self._wake()
+        if self.shm_dropped > 0:
+            logger.warning('{} shared memory frame(s) dropped, subscriber fell behind more than {} frames.'
+                           .format(self.shm_dropped, self.shm_slots))
+        for ring in self.shm_writers.values():
+            ring.close(unlink=True)
+        for ring in self.shm_readers.values():
+            ring.close()
+        self.shm_writers.clear()
+        self.shm_readers.clear()
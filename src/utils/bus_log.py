@@ -0,0 +1,199 @@
+# coding=utf-8
+import mmap
+import struct
+import logging
+import cv2
+import numpy as np
+from utils import can_codec
+from utils.frame import Frame
+
+logger = logging.getLogger("BusLog")
+
+MAGIC = b'MYCARLOG'
+VERSION = 1
+FILE_HEADER = struct.Struct('<8sI')  # magic, version
+CHUNK_MAGIC = b'MYCARCHK'
+CHUNK_HEADER = struct.Struct('<8sQ')  # magic, chunk size
+RECORD_HEADER = struct.Struct('<IIdHH')  # record size, payload size, timestamp, channel size, codec header size
+ALIGN = 8
+
+# codec header marker of a compressed image (besides 'utils.can_codec' ones),
+# followed by the image format (and ':timestamp:index' of a 'utils.frame.Frame')
+COMPRESSED = b'c'
+COMPRESSIONS = {'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY), 'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION)}
+
+
+class BusLogWriter:
+    """
+    Append-only log of CAN messages in a memory mapped file.
+
+    The file is a header followed by chunks, each chunk holds whole records:
+        record: size, payload size, timestamp, channel size, codec header size, channel, codec header, payload
+    Messages are encoded with 'utils.can_codec', image frames can be stored compressed (jpeg or png).
+    The file grows one chunk at a time, a record is written into the mapped chunk, its size last,
+    so a log cut short (e.g. power loss) is still readable up to the last complete record.
+    """
+
+    def __init__(self, path: str, chunk_size: int = 64 * 1024 * 1024, compress: str = None, quality: int = None):
+        """
+        Args:
+            path: the log file, overwritten if exists.
+            chunk_size: the file grows by that many bytes, a larger record gets a chunk of its own size.
+            compress: [Optional] store uint8 images compressed, 'jpeg' or 'png'.
+            quality: [Optional] jpeg quality (0-100), or png compression level (0-9).
+        """
+        if compress is not None and compress not in COMPRESSIONS:
+            raise ValueError("unknown bus log compression '{}', should be one of: {}"
+                             .format(compress, ', '.join(COMPRESSIONS)))
+        self.path = path
+        self.chunk_size = _align(chunk_size, mmap.ALLOCATIONGRANULARITY)
+        self.compress = compress
+        self._image_params = [COMPRESSIONS[compress][1], quality] if compress and quality is not None else []
+        self.records = 0
+
+        self._file = open(path, 'w+b')
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        self._chunk_start = 0
+        self._chunk = None
+        self._offset = 0  # in the chunk
+        self._end = mmap.ALLOCATIONGRANULARITY  # the first chunk starts after the file header, on a mapping boundary
+        self._file.truncate(self._end)
+
+    def append(self, channel: str, message, timestamp: float):
+        """
+        Append a message to the log.
+        """
+        frames = self._encode(message)
+        header = can_codec._bytes(frames[0])
+        payload = frames[1]
+        channel = channel.encode()
+        payload_size = len(memoryview(payload).cast('B'))
+        size = _align(RECORD_HEADER.size + len(channel) + len(header) + payload_size, ALIGN)
+
+        if self._chunk is None or self._offset + size + 4 > len(self._chunk):  # 4: room for the end of chunk mark
+            self._new_chunk(size)
+
+        chunk, offset = self._chunk, self._offset
+        start = offset + RECORD_HEADER.size
+        chunk[start:start + len(channel)] = channel
+        start += len(channel)
+        chunk[start:start + len(header)] = header
+        start += len(header)
+        chunk[start:start + payload_size] = memoryview(payload).cast('B')
+        RECORD_HEADER.pack_into(chunk, offset, 0, payload_size, timestamp, len(channel), len(header))
+        struct.pack_into('<I', chunk, offset, size)  # complete
+        self._offset += size
+        self.records += 1
+
+    def _encode(self, message) -> list:
+        if self.compress is not None and isinstance(message, np.ndarray) and message.dtype == np.uint8 \
+                and (message.ndim == 2 or (message.ndim == 3 and message.shape[2] in (1, 3, 4))):
+            ext = COMPRESSIONS[self.compress][0]
+            ok, encoded = cv2.imencode(ext, message, self._image_params)
+            if ok:
+                header = ext
+                if isinstance(message, Frame) and message.timestamp is not None:
+                    header += ':{!r}:{}'.format(message.timestamp, message.index if message.index is not None else '')
+                return [COMPRESSED + header.encode(), encoded]
+        return can_codec.encode(message)
+
+    def _new_chunk(self, record_size: int):
+        self._seal_chunk()
+        size = max(self.chunk_size, _align(CHUNK_HEADER.size + record_size + 4, mmap.ALLOCATIONGRANULARITY))
+        self._chunk_start = _align(self._end, mmap.ALLOCATIONGRANULARITY)
+        self._end = self._chunk_start + size
+        self._file.truncate(self._end)
+        self._chunk = mmap.mmap(self._file.fileno(), size, offset=self._chunk_start)
+        CHUNK_HEADER.pack_into(self._chunk, 0, CHUNK_MAGIC, size)
+        self._offset = CHUNK_HEADER.size
+
+    def _seal_chunk(self):
+        """
+        Shrink the header of the current chunk to its used size.
+        """
+        if self._chunk is not None:
+            CHUNK_HEADER.pack_into(self._chunk, 0, CHUNK_MAGIC, self._offset)
+            self._chunk.flush()
+            self._chunk.close()
+            self._chunk = None
+            self._end = self._chunk_start + self._offset
+
+    def close(self):
+        self._seal_chunk()
+        self._file.truncate(self._end)
+        self._file.close()
+        logger.info('Wrote {} message(s) to bus log {}, {:.1f}MB.'.format(self.records, self.path, self._end / 1e6))
+
+
+class BusLogReader:
+    """
+    Read a log written by 'BusLogWriter'.
+    The file is mapped read-only, array messages are views of the mapping, consumers should not modify them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = FILE_HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError('{} is not a bus log.'.format(path))
+        if version != VERSION:
+            raise ValueError('unsupported bus log version {} of {}.'.format(version, path))
+
+    def __iter__(self):
+        """
+        Yields:
+            (timestamp, channel, message) in recorded order.
+        """
+        for timestamp, channel, header, payload in self.records():
+            yield timestamp, channel, decode(header, payload)
+
+    def records(self):
+        """
+        Yields:
+            (timestamp, channel, codec header, payload) in recorded order, not decoded.
+        """
+        view = memoryview(self._mm)
+        chunk_start = mmap.ALLOCATIONGRANULARITY
+        while chunk_start + CHUNK_HEADER.size <= len(self._mm):
+            magic, chunk_size = CHUNK_HEADER.unpack_from(self._mm, chunk_start)
+            if magic != CHUNK_MAGIC:
+                break
+            offset = chunk_start + CHUNK_HEADER.size
+            chunk_end = min(chunk_start + chunk_size, len(self._mm))
+            while offset + RECORD_HEADER.size <= chunk_end:
+                size, payload_size, timestamp, channel_size, header_size = RECORD_HEADER.unpack_from(self._mm, offset)
+                if size == 0 or offset + size > chunk_end:  # end of chunk, an incomplete or a truncated record
+                    break
+                start = offset + RECORD_HEADER.size
+                channel = self._mm[start:start + channel_size].decode()
+                start += channel_size
+                header = self._mm[start:start + header_size]
+                start += header_size
+                yield timestamp, channel, header, view[start:start + payload_size]
+                offset += size
+            if chunk_end < chunk_start + chunk_size:  # truncated file
+                break
+            chunk_start = _align(chunk_start + chunk_size, mmap.ALLOCATIONGRANULARITY)
+
+    def close(self):
+        try:
+            self._mm.close()
+        except BufferError:  # messages still refer to the mapping, it is closed when they are released
+            pass
+
+
+def decode(header, payload):
+    """
+    Decode a message of 'BusLogReader.records'.
+    """
+    if header[:1] == COMPRESSED:
+        message = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        ext, *frame = header[1:].decode().split(':')
+        return can_codec._frame(message, frame)
+    return can_codec.decode([header, payload])
+
+
+def _align(size: int, align: int) -> int:
+    return (size + align - 1) // align * align
@@ -0,0 +1,184 @@
+# coding=utf-8
+import pickle
+import struct
+import numpy as np
+from utils.frame import Frame
+
+# header frame markers
+PICKLE = b'p'
+NDARRAY = b'n'
+SHARED = b's'
+TYPED = b't'
+GROUP = b'g'
+
+# scalar channel types -> struct format
+TYPES = {
+    'bool': '?',
+    'int8': 'b',
+    'uint8': 'B',
+    'int16': 'h',
+    'uint16': 'H',
+    'int32': 'i',
+    'uint32': 'I',
+    'int64': 'q',
+    'float32': 'f',
+    'float64': 'd',
+}
+STRUCT = 'struct:'  # prefix of a struct layout type, its messages are tuples, even of one field
+
+
+def struct_format(channel_type: str) -> str:
+    """
+    Struct format of a channel type: one of 'TYPES', or a struct layout as 'struct:<format>', e.g. 'struct:ff?'.
+    A struct layout keeps its 'struct:' prefix, see '_layout'.
+    """
+    if channel_type in TYPES:
+        return TYPES[channel_type]
+    if str(channel_type).startswith(STRUCT):
+        struct.calcsize('<' + channel_type[len(STRUCT):])  # validate
+        return channel_type
+    raise ValueError("unknown channel type '{}', should be one of: {}, or 'struct:<format>'"
+                     .format(channel_type, ', '.join(TYPES)))
+
+
+def topic(channel: str) -> bytes:
+    """
+    The channel frame. Terminated so that ZMQ's prefix subscription matches the exact channel only.
+    """
+    return channel.encode() + b'\x00'
+
+
+def channel_of(frame) -> str:
+    return _bytes(frame)[:-1].decode()
+
+
+def encode(message) -> list:
+    """
+    Encode a message into wire frames: [header, payload].
+    Numeric numpy arrays are sent as a small 'dtype:shape(:timestamp:index)' header plus the raw array buffer,
+    so they can be sent with 'copy=False' and rebuilt without unpickling.
+    A 'utils.frame.Frame' keeps its capture timestamp and index.
+    Everything else is pickled.
+    """
+    if isinstance(message, np.ndarray) and message.dtype.kind in 'biuf':
+        header = NDARRAY + _array_header(message).encode()
+        if not message.flags['C_CONTIGUOUS']:
+            message = np.ascontiguousarray(message)
+        return [header, message]
+    return [PICKLE, pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)]
+
+
+def encode_typed(fmt: str, message) -> list:
+    """
+    Encode a message of a typed channel with struct, a scalar or a tuple (struct layout).
+
+    Raises:
+        struct.error: the message does not fit the type (e.g. None).
+    """
+    layout, is_struct = _layout(fmt)
+    values = tuple(message) if is_struct else (message,)
+    return [TYPED + fmt.encode(), struct.pack('<' + layout, *values)]
+
+
+def encode_group(fmts: list, messages: list) -> list:
+    """
+    Encode the messages of a group of typed channels into one message.
+
+    Raises:
+        struct.error: one of the messages does not fit its type.
+    """
+    values, layouts = [], []
+    for fmt, message in zip(fmts, messages):
+        layout, is_struct = _layout(fmt)
+        if is_struct:
+            values.extend(message)
+        else:
+            values.append(message)
+        layouts.append(layout)
+    return [GROUP + ','.join(fmts).encode(), struct.pack('<' + ''.join(layouts), *values)]
+
+
+def encode_shared(ring_name: str, slot: int, seq: int, array: np.ndarray) -> list:
+    """
+    Encode an array which has been written to a shared memory ring ('utils.shm_ring'),
+    only the ring slot reference is sent.
+    """
+    header = SHARED + '{}:{}:{}:{}'.format(ring_name, slot, seq, _array_header(array)).encode()
+    return [header, b'']
+
+
+def decode(frames: list, shared_ring=None):
+    """
+    Decode wire frames ([header, payload]) back into the message.
+    Frames can be bytes or zmq.Frame (received with 'copy=False').
+    Arrays are rebuilt on top of the received buffer (no copy), consumers should not modify them,
+    shared memory frames are copied out of the ring (see 'utils.shm_ring').
+
+    Args:
+        shared_ring: function to get a 'SharedFrameRing' by name, required to decode shared memory frames.
+
+    Returns:
+        the message, or a list of messages for a group message.
+
+    Raises:
+        LookupError: the shared memory slot has already been overwritten.
+    """
+    header = _bytes(frames[0])
+    payload = frames[1].buffer if hasattr(frames[1], 'buffer') else frames[1]
+    if header[:1] == TYPED:
+        layout, is_struct = _layout(header[1:].decode())
+        values = struct.unpack('<' + layout, payload)
+        return values if is_struct else values[0]
+    if header[:1] == GROUP:
+        layouts = [_layout(fmt) for fmt in header[1:].decode().split(',')]
+        values = struct.unpack('<' + ''.join(layout for layout, _ in layouts), payload)
+        messages, i = [], 0
+        for layout, is_struct in layouts:
+            n = len(struct.unpack('<' + layout, bytes(struct.calcsize('<' + layout))))
+            messages.append(values[i:i + n] if is_struct else values[i])
+            i += n
+        return messages
+    if header[:1] == NDARRAY:
+        dtype, shape, *frame = header[1:].decode().split(':')
+        return _frame(np.frombuffer(payload, dtype=dtype).reshape(_shape(shape)), frame)
+    if header[:1] == SHARED:
+        name, slot, seq, dtype, shape, *frame = header[1:].decode().split(':')
+        array = shared_ring(name).read(int(slot), int(seq), dtype, _shape(shape))
+        if array is None:
+            raise LookupError('frame {} in shared memory ring {} has been overwritten'.format(seq, name))
+        return _frame(array, frame)
+    return pickle.loads(payload)
+
+
+def _layout(fmt: str) -> tuple:
+    """
+    Returns:
+        (struct format, whether it is a struct layout), of a format of 'struct_format'.
+    """
+    if fmt.startswith(STRUCT):
+        return fmt[len(STRUCT):], True
+    return fmt, False
+
+
+def _array_header(array: np.ndarray) -> str:
+    header = '{}:{}'.format(array.dtype.str, ','.join(str(d) for d in array.shape))
+    if isinstance(array, Frame) and array.timestamp is not None:
+        header += ':{!r}:{}'.format(array.timestamp, array.index if array.index is not None else '')
+    return header
+
+
+def _frame(array: np.ndarray, frame: list) -> np.ndarray:
+    """
+    Rebuild the Frame from the 'timestamp:index' header fields, if any.
+    """
+    if len(frame) == 0:
+        return array
+    return Frame(array, float(frame[0]), int(frame[1]) if frame[1] else None)
+
+
+def _shape(shape: str) -> tuple:
+    return tuple(int(d) for d in shape.split(',')) if shape else ()
+
+
+def _bytes(frame) -> bytes:
+    return frame.bytes if hasattr(frame, 'bytes') else bytes(frame)
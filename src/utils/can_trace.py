@@ -0,0 +1,111 @@
+# coding=utf-8
+from collections import namedtuple
+from threading import Lock
+import struct
+import logging
+
+logger = logging.getLogger("CANTrace")
+
+# origin: (monotonic) time the data was created, e.g. the camera frame capture time,
+#         messages derived from it (e.g. steering) carry the same origin.
+# seq: sequence number of the message in the channel, per producer.
+# producer: who published the message.
+# sent: (monotonic) time the message was published.
+Envelope = namedtuple('Envelope', ['origin', 'seq', 'producer', 'sent'])
+
+_ENVELOPE_STRUCT = struct.Struct('<dQd')
+
+
+def pack_envelope(envelope: Envelope) -> bytes:
+    return _ENVELOPE_STRUCT.pack(envelope.origin, envelope.seq, envelope.sent) + envelope.producer.encode()
+
+
+def unpack_envelope(data) -> Envelope:
+    data = bytes(data)
+    origin, seq, sent = _ENVELOPE_STRUCT.unpack_from(data)
+    return Envelope(origin, seq, data[_ENVELOPE_STRUCT.size:].decode(), sent)
+
+
+class LatencyHistogram:
+    """
+    Latency histogram with power of 2 buckets, from 1us to ~1min.
+    """
+    BUCKETS = 27
+
+    def __init__(self):
+        self.buckets = [0] * LatencyHistogram.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        us = max(int(seconds * 1e6), 1)
+        self.buckets[min(us.bit_length() - 1, LatencyHistogram.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        """
+        Returns:
+            upper bound (seconds) of the bucket containing the p-th percentile.
+        """
+        target = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n > 0 and seen >= target:
+                return min((2 ** (i + 1)) / 1e6, self.max)
+        return self.max
+
+    def summary(self) -> str:
+        if self.count == 0:
+            return 'n=0'
+        return 'n={}, mean={:.2f}ms, p50<={:.2f}ms, p90<={:.2f}ms, p99<={:.2f}ms, max={:.2f}ms'.format(
+            self.count, self.total / self.count * 1000, self.percentile(50) * 1000, self.percentile(90) * 1000,
+            self.percentile(99) * 1000, self.max * 1000)
+
+
+class CANTrace:
+    """
+    Per channel latency stats of the traced messages:
+        hop: from publish to dispatch to the listener (transport + waiting in the mailbox).
+        age: from origin to dispatch to the listener, e.g. camera capture -> steering servo.
+        gaps: messages missing in the sequence (dropped by transport).
+    """
+
+    def __init__(self):
+        self.hop = {}  # channel -> histogram
+        self.age = {}  # channel -> histogram
+        self.gaps = {}  # channel -> count
+        self._last_seq = {}  # (producer, channel) -> seq
+        self._lock = Lock()
+
+    def received(self, channel: str, envelope: Envelope):
+        """
+        A message arrived at this CAN, check the sequence.
+        """
+        with self._lock:
+            key = (envelope.producer, channel)
+            last = self._last_seq.get(key)
+            if last is not None and envelope.seq > last + 1:
+                self.gaps[channel] = self.gaps.get(channel, 0) + envelope.seq - last - 1
+            self._last_seq[key] = envelope.seq
+
+    def dispatched(self, channel: str, envelope: Envelope, now: float):
+        """
+        A message is about to be consumed by a listener.
+        """
+        with self._lock:
+            if channel not in self.hop:
+                self.hop[channel] = LatencyHistogram()
+                self.age[channel] = LatencyHistogram()
+            self.hop[channel].add(now - envelope.sent)
+            self.age[channel].add(now - envelope.origin)
+
+    def dump(self, name: str = 'CAN'):
+        with self._lock:
+            for channel in sorted(self.hop):
+                logger.info('{} channel {}: gaps={}'.format(name, channel, self.gaps.get(channel, 0)))
+                logger.info('    hop: {}'.format(self.hop[channel].summary()))
+                logger.info('    age: {}'.format(self.age[channel].summary()))
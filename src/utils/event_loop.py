@@ -0,0 +1,108 @@
+# coding=utf-8
+import asyncio
+import logging
+import os
+from threading import Thread, Lock
+
+logger = logging.getLogger("EventLoop")
+
+_loops = {}  # pid -> event loop shared by the async components of the process
+_stops = {}  # (pid, id of stop event, id of loop) -> asyncio.Event set when the stop event is set
+_lock = Lock()
+
+
+def process_loop() -> asyncio.AbstractEventLoop:
+    """
+    The event loop shared by the async components ('async def run', 'async def on_message') of the current process,
+    created and run in its own thread on first use.
+    """
+    with _lock:
+        loop = _loops.get(os.getpid())
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            Thread(name='asyncio-loop', target=loop.run_forever, daemon=True).start()
+            _loops[os.getpid()] = loop
+        return loop
+
+
+def run_coroutine(coroutine, name: str = None):
+    """
+    Schedule a coroutine on the process event loop, its failure is logged.
+
+    Returns:
+        concurrent.futures.Future of the result
+    """
+    future = asyncio.run_coroutine_threadsafe(coroutine, process_loop())
+
+    def done(f):
+        if not f.cancelled() and f.exception() is not None:
+            logger.error('{} failed: {}'.format(name or coroutine, f.exception()))
+    future.add_done_callback(done)
+    return future
+
+
+class Wake:
+    """
+    Wake up a coroutine of an event loop from any thread.
+    The asyncio.Event is created on the loop, on first use (before Python 3.10 an Event binds to the loop
+    current where it is created).
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._event = None
+
+    def set(self):
+        """
+        Thread safe.
+        """
+        self._loop.call_soon_threadsafe(self._set)
+
+    def clear(self):
+        if self._event is not None:
+            self._event.clear()
+
+    async def wait(self):
+        await self._get().wait()
+
+    def _set(self):
+        self._get().set()
+
+    def _get(self) -> asyncio.Event:
+        if self._event is None:
+            self._event = asyncio.Event()
+        return self._event
+
+
+async def wait_stop(stop_event, timeout: float = None) -> bool:
+    """
+    Await the stop event (threading or multiprocessing Event) of the Car, without blocking the event loop.
+    One watcher thread per stop event, shared by all the awaiting coroutines.
+
+    Returns:
+        True if stopped, False if timed out.
+    """
+    if stop_event.is_set():
+        return True
+    stopped = _stopped(stop_event)
+    try:
+        await asyncio.wait_for(stopped.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    return stop_event.is_set()
+
+
+def _stopped(stop_event) -> asyncio.Event:
+    loop = asyncio.get_event_loop()
+    key = (os.getpid(), id(stop_event), id(loop))
+    with _lock:
+        stopped = _stops.get(key)
+        if stopped is None:
+            stopped = asyncio.Event()
+
+            def watch():
+                stop_event.wait()
+                loop.call_soon_threadsafe(stopped.set)
+            Thread(name='asyncio-stop-watch', target=watch, daemon=True).start()
+            _stops[key] = stopped
+        return stopped
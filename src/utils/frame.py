@@ -0,0 +1,45 @@
+# coding=utf-8
+import numpy as np
+
+
+class Frame(np.ndarray):
+    """
+    A camera frame: an image array with its capture time and index.
+        timestamp: time.monotonic() when the frame was captured.
+        index: frame counter of the camera, from 1.
+    Views (e.g. a ROI slice) keep them, arrays computed by OpenCV are plain arrays, see 'Frame.of'.
+    """
+
+    def __new__(cls, array, timestamp: float = None, index: int = None):
+        frame = np.asarray(array).view(cls)
+        frame.timestamp = timestamp
+        frame.index = index
+        return frame
+
+    def __array_finalize__(self, obj):
+        self.timestamp = getattr(obj, 'timestamp', None)
+        self.index = getattr(obj, 'index', None)
+
+    @staticmethod
+    def of(array, like) -> 'Frame':
+        """
+        Attach the timestamp and index of frame 'like' (if it is a Frame) to an array derived from it.
+        """
+        if not isinstance(like, Frame):
+            return array
+        return Frame(array, like.timestamp, like.index)
+
+    def __reduce__(self):
+        state = super(Frame, self).__reduce__()
+        return state[0], state[1], (state[2], self.timestamp, self.index)
+
+    def __setstate__(self, state):
+        super(Frame, self).__setstate__(state[0])
+        self.timestamp, self.index = state[1], state[2]
+
+
+def timestamp_of(frame) -> float:
+    """
+    Capture time of a frame, None if unknown (a bare array).
+    """
+    return getattr(frame, 'timestamp', None)
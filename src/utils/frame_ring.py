@@ -0,0 +1,74 @@
+# coding=utf-8
+from threading import Lock
+import numpy as np
+
+
+class FrameRing:
+    """
+    A ring of preallocated frames between a capture thread and a consumer thread, in the same process.
+    The capture thread reads each frame in place into a free slot ('acquire', 'commit'),
+    the consumer takes a copy of the newest frame ('latest').
+    A slot is never overwritten while it is being copied (reference counted), with 3 slots the writer always has one.
+    """
+
+    def __init__(self, shape: tuple, dtype=np.uint8, slots: int = 3):
+        if slots < 3:
+            raise ValueError('FrameRing requires at least 3 slots.')
+        self.frames = [np.empty(shape, dtype=dtype) for _ in range(slots)]
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.seq = 0  # sequence number of the newest frame
+        self._refs = [0] * slots
+        self._timestamps = [0.0] * slots
+        self._seqs = [0] * slots
+        self._latest = None  # slot of the newest frame
+        self._lock = Lock()
+
+    def acquire(self) -> tuple:
+        """
+        A free slot to write the next frame into.
+
+        Returns:
+            (slot, frame buffer)
+        """
+        with self._lock:
+            for slot, refs in enumerate(self._refs):
+                if refs == 0 and slot != self._latest:
+                    return slot, self.frames[slot]
+        raise RuntimeError('FrameRing has no free slot, more than one consumer?')
+
+    def commit(self, slot: int, timestamp: float):
+        """
+        The frame in the slot is complete, make it the newest one.
+        """
+        with self._lock:
+            self.seq += 1
+            self._seqs[slot] = self.seq
+            self._timestamps[slot] = timestamp
+            self._latest = slot
+
+    def latest(self, out: np.ndarray = None) -> tuple:
+        """
+        Copy the newest frame.
+
+        Args:
+            out: [Optional] array to copy into, a new array by default.
+
+        Returns:
+            (sequence number, timestamp, frame), or None if there is no frame yet.
+        """
+        with self._lock:
+            slot = self._latest
+            if slot is None:
+                return None
+            self._refs[slot] += 1
+            seq, timestamp = self._seqs[slot], self._timestamps[slot]
+        try:
+            if out is None:
+                out = self.frames[slot].copy()
+            else:
+                np.copyto(out, self.frames[slot])
+        finally:
+            with self._lock:
+                self._refs[slot] -= 1
+        return seq, timestamp, out
@@ -0,0 +1,114 @@
+# coding=utf-8
+import os
+import logging
+import cv2
+from utils import bus_log
+from utils.bus_log import BusLogReader
+
+logger = logging.getLogger("FrameSource")
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+SOURCES = ('file', 'directory', 'buslog')  # see 'open_source'
+
+
+def video_frames(path: str, start: int = 0):
+    """
+    Frames of a video file.
+
+    Args:
+        start: index of the first frame.
+
+    Yields:
+        (timestamp in seconds from the start of the video, frame)
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError('Failed to open video {}.'.format(path))
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    if start > 0:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    index = start
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            position = capture.get(cv2.CAP_PROP_POS_MSEC)  # presentation time, 0 if not supported
+            yield (position / 1000.0 if position > 0 else index / fps), frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def directory_frames(path: str, frame_rate: float):
+    """
+    Image files of a directory, in file name order.
+
+    Yields:
+        (timestamp in seconds, frame), images are 1 / frame_rate apart.
+    """
+    files = sorted(f for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+    if len(files) == 0:
+        raise IOError('No image in directory {}.'.format(path))
+    for index, file in enumerate(files):
+        frame = cv2.imread(os.path.join(path, file), cv2.IMREAD_UNCHANGED)
+        if frame is None:
+            logger.warning('Skipped unreadable image {}.'.format(file))
+            continue
+        yield index / frame_rate, frame
+
+
+def bus_log_frames(path: str, channel: str = 'cam/image', start: int = 0):
+    """
+    Frames of a channel in a bus log ('utils.bus_log').
+
+    Args:
+        start: index of the first frame, the frames before are skipped without decoding.
+
+    Yields:
+        (recorded timestamp, frame)
+    """
+    reader = BusLogReader(path)
+    try:
+        index = 0
+        for timestamp, recorded_channel, header, payload in reader.records():
+            if recorded_channel != channel:
+                continue
+            index += 1
+            if index <= start:
+                continue
+            message = bus_log.decode(header, payload)
+            if message is not None:
+                yield timestamp, message
+    finally:
+        reader.close()
+
+
+def frame_count(source: str, path: str, channel: str = 'cam/image') -> int:
+    """
+    Number of frames of a 'file' or 'buslog' source.
+    """
+    if source == 'file':
+        capture = cv2.VideoCapture(path)
+        count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+        return count
+    elif source == 'buslog':
+        reader = BusLogReader(path)
+        count = sum(1 for record in reader.records() if record[1] == channel)
+        reader.close()
+        return count
+    raise ValueError("unknown frame source '{}', should be one of: file, buslog".format(source))
+
+
+def open_source(source: str, path: str, frame_rate: float, channel: str = 'cam/image'):
+    """
+    Frames of an offline source: 'file' (video), 'directory' (images) or 'buslog'.
+    """
+    if source == 'file':
+        return video_frames(path)
+    elif source == 'directory':
+        return directory_frames(path, frame_rate)
+    elif source == 'buslog':
+        return bus_log_frames(path, channel)
+    raise ValueError("unknown frame source '{}', should be one of: {}".format(source, ', '.join(SOURCES)))
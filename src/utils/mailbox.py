@@ -0,0 +1,109 @@
+# coding=utf-8
+import re
+import typing
+from collections import deque
+from threading import Condition
+
+ALL = 'all'
+LATEST = 'latest'
+
+
+def parse_policy(policy) -> int:
+    """
+    Parse a channel delivery policy.
+        'all': lossless, every message is delivered.
+        'latest': keep only the newest message, overwrite the pending one.
+        'queue(N)': keep at most N pending messages, drop the oldest.
+
+    Returns:
+        max number of pending messages, None if unbounded.
+    """
+    if policy is None or policy == ALL:
+        return None
+    if policy == LATEST:
+        return 1
+    match = re.match(r'^queue\((\d+)\)$', str(policy).replace(' ', ''))
+    if match is None or int(match.group(1)) < 1:
+        raise ValueError("unknown channel delivery policy '{}', should be one of: all, latest, queue(N)".format(policy))
+    return int(match.group(1))
+
+
+class Mailbox:
+    """
+    Pending messages of one subscriber, a bounded queue per channel according to the channel's delivery policy.
+    Messages are taken out in arrival order across channels, urgent (control lane) messages first.
+    """
+
+    def __init__(self, policies: dict = None, notify: typing.Callable = None):
+        """
+        Args:
+            policies: dict of channel -> max number of pending messages (see 'parse_policy'), default unbounded.
+            notify: [Optional] called after a put or close, e.g. to wake up an asyncio consumer.
+        """
+        self.policies = policies or {}
+        self.queues = {}  # channel -> deque of (arrival sequence, urgent, message)
+        self.dropped = {}  # channel -> number of dropped messages
+        self.pending = 0
+        self.closed = False
+        self._seq = 0
+        self._cond = Condition()
+        self._notify = notify
+
+    def put(self, channel: str, message, urgent: bool = False):
+        with self._cond:
+            self._put(channel, message, urgent)
+            self._cond.notify()
+        if self._notify is not None:
+            self._notify()
+
+    def put_many(self, items: list, urgent: bool = False):
+        """
+        Put messages of multiple channels at once, no other message can get in between.
+
+        Args:
+            items: list of (channel, message)
+        """
+        with self._cond:
+            for channel, message in items:
+                self._put(channel, message, urgent)
+            self._cond.notify()
+        if self._notify is not None:
+            self._notify()
+
+    def _put(self, channel: str, message, urgent: bool):
+        queue = self.queues.get(channel)
+        if queue is None:
+            queue = deque(maxlen=self.policies.get(channel))
+            self.queues[channel] = queue
+            self.dropped[channel] = 0
+
+        if len(queue) == queue.maxlen:  # oldest one will be dropped
+            self.dropped[channel] += 1
+        else:
+            self.pending += 1
+        queue.append((self._seq, urgent, message))
+        self._seq += 1
+
+    def get(self, timeout: float = None) -> tuple:
+        """
+        Take the earliest pending message, block until there is one.
+
+        Returns:
+            (channel, message), or None if closed or timed out.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.pending > 0 or self.closed, timeout) or self.closed:
+                return None
+
+            pending = [(c, q) for c, q in self.queues.items() if len(q) > 0]
+            urgent = [(c, q) for c, q in pending if q[0][1]]
+            channel, queue = min(urgent or pending, key=lambda cq: cq[1][0][0])
+            self.pending -= 1
+            return channel, queue.popleft()[2]
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        if self._notify is not None:
+            self._notify()
@@ -0,0 +1,73 @@
+# coding=utf-8
+
+
+class PIDController:
+    """
+    PID steering from the cross track error, with integrator reset and dynamic clamping against windup.
+    """
+
+    def __init__(self, coeffs, interval: float = None):
+        """
+        Args:
+            coeffs: [Kp, Kd, Ki], referenced (not copied), so tuning them in place takes effect.
+            interval: [Optional] the nominal time between two steerings the coefficients are tuned for,
+                required to steer with the real elapsed time ('steer' with dt).
+        """
+        self.coeffs = coeffs
+        self.interval = interval
+        self.int_cte = 0  # integral cross track error
+        self.prev_cte = 0  # previous cross track error
+
+    def reset(self):
+        self.int_cte = 0
+        self.prev_cte = 0
+
+    def steer(self, cte, dt: float = None) -> float:
+        """
+        Use the equation: new_steering = Kp * cte + Ki * cte_integrational + Kd * cte_differential
+        to calculate the new steering.
+
+        Args:
+            dt: [Optional] seconds since the previous steering, the differential and integrational terms
+                are scaled from the nominal interval to it. Per step when None.
+        """
+        scale = dt / self.interval if dt is not None and dt > 0 and self.interval else 1.0
+        diff_cte = (cte - self.prev_cte) / scale
+        self.prev_cte = cte
+        self.int_cte += cte * scale
+
+        # proportional
+        pid_p = self.coeffs[0] * cte
+
+        # differential
+        pid_d = self.coeffs[1] * diff_cte
+
+        # integrational
+        if abs(cte) <= 10:  # anti integerator windup (over shooting)
+            self.int_cte = 0
+
+        pid_i = self.coeffs[2] * self.int_cte
+
+        # anti windup via dynamic integrator clamping
+        int_limit_max = 0.0
+        int_limit_min = 0.0
+        if pid_p < 1:
+            int_limit_max = 1 - pid_p
+        if pid_p > -1:
+            int_limit_min = -1 - pid_p
+
+        if pid_i > int_limit_max:
+            pid_i = int_limit_max
+        elif pid_i < int_limit_min:
+            pid_i = int_limit_min
+
+        # sum up
+        steer = pid_p + pid_d + pid_i
+
+        # apply limits
+        if steer < -1:
+            return -1
+        elif steer > 1:
+            return 1
+        else:
+            return steer
@@ -0,0 +1,150 @@
+# coding=utf-8
+import os
+import re
+import mmap
+import tempfile
+import logging
+import numpy as np
+
+logger = logging.getLogger("SharedFrameRing")
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+NAME_PREFIX = 'mycar-'
+MAGIC = b'MYCARSHM'
+HEADER_SIZE = 64  # magic(8), slots(8), slot_size(8), padding
+ALIGN = 64
+
+
+class SharedFrameRing:
+    """
+    A ring of preallocated, fixed size slots in shared memory (a memory mapped file under /dev/shm).
+    The writer process copies each frame into the next slot, so only (slot, sequence) has to be sent over the CAN,
+    reader processes map the same memory read-only and copy the frame out of it, once, skipping the sockets.
+
+    Each slot has a sequence number, a reader can tell if the slot has been overwritten
+    by a newer frame (the reader is more than 'slots' frames behind the writer).
+    The sequence is checked again after the copy, so a frame overwritten while being copied is dropped too;
+    the returned frame is the reader's own, the writer can reuse the slot at any time.
+    """
+
+    def __init__(self, name: str, writable: bool):
+        self.name = name
+        self.writable = writable
+        self.path = os.path.join(SHM_DIR, name)
+
+        with open(self.path, 'r+b' if writable else 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a shared frame ring.'.format(self.path))
+        self.slots, self.slot_size = np.frombuffer(self._mm, dtype=np.uint64, count=2, offset=len(MAGIC)).tolist()
+        self._seqs = np.frombuffer(self._mm, dtype=np.uint64, count=self.slots, offset=HEADER_SIZE)
+        self._data_offset = _align(HEADER_SIZE + self.slots * 8)
+        self._next_seq = 1
+
+    @staticmethod
+    def create(name: str, slot_size: int, slots: int = 8):
+        """
+        Create a new ring (writer side).
+        """
+        SharedFrameRing.cleanup()
+        slot_size = _align(slot_size)
+        with open(os.path.join(SHM_DIR, name), 'w+b') as f:
+            f.truncate(_align(HEADER_SIZE + slots * 8) + slots * slot_size)
+            f.write(MAGIC)
+            f.write(np.array([slots, slot_size], dtype=np.uint64).tobytes())
+        logger.info('Created shared frame ring {}, {} slots of {} bytes.'.format(name, slots, slot_size))
+        return SharedFrameRing(name, True)
+
+    @staticmethod
+    def attach(name: str):
+        """
+        Attach to an existing ring read-only (reader side).
+        """
+        return SharedFrameRing(name, False)
+
+    @staticmethod
+    def cleanup():
+        """
+        Remove rings left behind by processes that no longer exist.
+        """
+        for file in os.listdir(SHM_DIR):
+            match = re.match(NAME_PREFIX + r'(\d+)-', file)
+            if match and not _pid_alive(int(match.group(1))):
+                try:
+                    os.remove(os.path.join(SHM_DIR, file))
+                except OSError:
+                    pass
+
+    def write(self, array: np.ndarray) -> tuple:
+        """
+        Copy the array to the next slot.
+
+        Returns:
+            slot, sequence
+        """
+        seq = self._next_seq
+        self._next_seq += 1
+        slot = seq % self.slots
+
+        self._seqs[slot] = 0  # slot is being written
+        np.copyto(self._slot_array(slot, array.dtype, array.shape), array, casting='no')
+        self._seqs[slot] = seq
+        return slot, seq
+
+    def read(self, slot: int, seq: int, dtype, shape: tuple):
+        """
+        Copy the frame out of the slot.
+
+        Returns:
+            the frame, or None if the slot has been overwritten (before or during the copy).
+        """
+        if int(self._seqs[slot]) != seq:
+            return None
+        array = self._slot_array(slot, dtype, shape).copy()
+        if int(self._seqs[slot]) != seq:  # the writer got to the slot while copying, torn
+            return None
+        return array
+
+    def _slot_array(self, slot, dtype, shape) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        if count * dtype.itemsize > self.slot_size:
+            raise ValueError('frame of {} bytes does not fit in slot of {} bytes.'
+                             .format(count * dtype.itemsize, self.slot_size))
+        return np.frombuffer(self._mm, dtype=dtype, count=count,
+                             offset=self._data_offset + slot * self.slot_size).reshape(shape)
+
+    def close(self, unlink: bool = False):
+        # arrays still referring to the memory keep it mapped, mmap is released when they are gone.
+        self._seqs = None
+        try:
+            self._mm.close()
+        except BufferError:
+            pass
+        if unlink:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def ring_name(channel: str, generation: int = 0) -> str:
+    """
+    A unique ring name for a channel published by this process.
+    """
+    return '{}{}-{}-{}'.format(NAME_PREFIX, os.getpid(), generation, re.sub(r'[^0-9a-zA-Z_]', '_', channel))
+
+
+def _align(size: int) -> int:
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,6 @@
+# coding=utf-8
+import os
+import sys
+
+# the modules are imported from src, as when running the car (PYTHONPATH=src)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
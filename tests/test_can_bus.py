@@ -0,0 +1,179 @@
+# coding=utf-8
+import itertools
+import threading
+import time
+import numpy as np
+import pytest
+from components.local_can import LocalCAN
+from components.zmq_can import ZmqCAN
+
+_ports = itertools.count(7300, 10)
+
+
+def _wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture(params=['local', 'zmq'])
+def make_bus(request):
+    """
+    Build started buses, a LocalCAN or a ZmqCAN client of an inproc broker, stopped at the end of the test.
+    """
+    stop = threading.Event()
+    buses = []
+
+    def make(**can_args):
+        if request.param == 'zmq':
+            port = next(_ports)
+            broker = ZmqCAN(True, transport='inproc', port=port, capture=False)
+            threading.Thread(target=broker.run, args=(stop,), daemon=True).start()
+            can = ZmqCAN(False, transport='inproc', port=port, **can_args)
+        else:
+            can = LocalCAN(**can_args)
+        can.start()
+        threading.Thread(target=can.run, args=(stop,), daemon=True).start()
+        buses.append(can)
+        return can
+
+    yield make
+    stop.set()
+    for can in buses:
+        can.shutdown()
+
+
+def _subscribed(can):
+    """
+    Let the subscriptions reach the broker.
+    """
+    time.sleep(0.2 if isinstance(can, ZmqCAN) else 0.0)
+
+
+def test_publish_subscribe(make_bus):
+    can = make_bus()
+    a, b = [], []
+    can.subscribe(['x'], lambda channel, message: a.append((channel, message)))
+    can.subscribe(['x', 'y'], lambda channel, message: b.append((channel, message)))
+    _subscribed(can)
+
+    can.publish('x', 1)
+    can.publish('y', {'k': 2})
+    can.publish('z', 3)  # nobody listens
+    assert _wait_for(lambda: len(a) == 1 and len(b) == 2)
+    time.sleep(0.05)
+    assert a == [('x', 1)]
+    assert b == [('x', 1), ('y', {'k': 2})]
+
+
+def test_all_channels(make_bus):
+    can = make_bus()
+    received = []
+    can.subscribe([LocalCAN.ALL_CHANNELS], lambda channel, message: received.append(channel))
+    _subscribed(can)
+
+    can.publish('x', 1)
+    can.publish('y', 2)
+    assert _wait_for(lambda: received == ['x', 'y'])
+
+
+def test_unsubscribe(make_bus):
+    can = make_bus()
+    received = []
+
+    def listener(channel, message):
+        received.append(message)
+
+    can.subscribe(['x'], listener)
+    _subscribed(can)
+    can.publish('x', 1)
+    assert _wait_for(lambda: received == [1])
+
+    can.unsubscribe(listener)
+    assert can.subscriber_counts().get('x', 0) == 0
+    can.publish('x', 2)
+    time.sleep(0.1)
+    assert received == [1]
+
+
+def test_control_lane_before_bulk(make_bus):
+    can = make_bus()
+    received = []
+
+    def listener(channel, message):
+        time.sleep(0.005)  # slow listener, the frames queue up
+        received.append(channel)
+
+    can.subscribe(['cam/image', 'steering'], listener)
+    _subscribed(can)
+    frame = np.zeros((36, 64, 3), np.uint8)
+    for _ in range(20):
+        can.publish('cam/image', frame)
+    can.publish('steering', 0.5)
+    assert _wait_for(lambda: len(received) == 21)
+    assert received.index('steering') < 5
+
+
+def test_lanes():
+    can = LocalCAN(channels={'x': {'lane': LocalCAN.BULK}, 'y': {'policy': 'latest', 'lane': LocalCAN.CONTROL}})
+    for channel, message in (('x', 1), ('y', np.zeros(2)), ('image', np.zeros(2)), ('image', 1), ('none', None),
+                             ('steering', 0.5)):
+        can.publish(channel, message)
+    assert can.channel_lanes == {'x': LocalCAN.BULK, 'y': LocalCAN.CONTROL, 'image': LocalCAN.BULK,
+                                 'none': LocalCAN.BULK, 'steering': LocalCAN.CONTROL}
+    with pytest.raises(ValueError):
+        LocalCAN(channels={'x': {'lane': 'fast'}})
+
+
+def test_typed_group(make_bus):
+    can = make_bus(channels={'js_steering': {'type': 'float32'}, 'js_autonomous': {'type': 'bool'},
+                             'js_mode': {'type': 'struct:ff'}},
+                   groups={'js': ['js_steering', 'js_autonomous']})
+    received = []
+    can.subscribe(['js_steering', 'js_autonomous', 'js_mode', 'other'],
+                  lambda channel, message: received.append((channel, message)))
+    _subscribed(can)
+
+    can.publish_many([('js_steering', 0.5), ('other', 'x'), ('js_autonomous', True)])
+    can.publish_many([('js_steering', -0.25)])  # incomplete group, sent alone
+    can.publish('js_mode', (1.0, 2.0))
+    assert _wait_for(lambda: len(received) == 5)
+    assert received[:2] == [('js_steering', 0.5), ('js_autonomous', True)]
+    assert sorted(received[2:], key=str) == [('js_mode', (1.0, 2.0)), ('js_steering', -0.25), ('other', 'x')]
+
+
+def test_group_of_untyped_channels():
+    with pytest.raises(ValueError):
+        LocalCAN(channels={'a': {'type': 'float32'}}, groups={'g': ['a', 'b']})
+
+
+def test_local_messages_by_reference():
+    can = LocalCAN()
+    received = []
+    can.subscribe(['x'], lambda channel, message: received.append(message))
+    message = object()
+    can.publish('x', message)
+    assert _wait_for(lambda: len(received) == 1)
+    assert received[0] is message
+    can.shutdown()
+
+
+def test_local_direct_dispatch_in_publisher_thread():
+    can = LocalCAN(direct_dispatch=True)
+    threads = []
+    can.subscribe(['x'], lambda channel, message: threads.append(threading.current_thread()))
+    can.publish('x', 1)
+    assert threads == [threading.current_thread()]
+    can.shutdown()
+
+
+def test_zmq_endpoints():
+    endpoints = ZmqCAN.endpoints('tcp', 'car.local', 6000)
+    assert endpoints['backend'] == ('tcp://*:6000', 'tcp://car.local:6000')
+    assert endpoints['bulk_capture'][1] == 'tcp://car.local:6005'
+    assert ZmqCAN.endpoints('ipc', ipc_dir='/run')['frontend'] == ('ipc:///run/mycar-can-6001',) * 2
+    with pytest.raises(ValueError):
+        ZmqCAN.endpoints('udp')
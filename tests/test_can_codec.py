@@ -0,0 +1,71 @@
+# coding=utf-8
+import numpy as np
+import pytest
+from utils import can_codec
+from utils.frame import Frame
+from utils.shm_ring import SharedFrameRing, ring_name
+
+
+def test_pickle_roundtrip():
+    message = {'a': [1, 2], 'b': None}
+    assert can_codec.decode(can_codec.encode(message)) == message
+
+
+def test_array_roundtrip_keeps_frame_fields():
+    frame = Frame(np.arange(24, dtype=np.uint8).reshape(2, 4, 3), 12.5, 7)
+    decoded = can_codec.decode(can_codec.encode(frame))
+    assert np.array_equal(decoded, frame)
+    assert decoded.timestamp == 12.5 and decoded.index == 7
+
+
+def test_non_contiguous_array():
+    array = np.arange(48, dtype=np.float32).reshape(4, 12)[:, ::3]
+    assert np.array_equal(can_codec.decode(can_codec.encode(array)), array)
+
+
+@pytest.mark.parametrize('channel_type, message', [
+    ('float32', 0.25),
+    ('bool', True),
+    ('int16', -3),
+    ('struct:ff?', (1.0, 2.0, True)),
+    ('struct:f', (1.5,)),  # a one-field layout stays a tuple
+])
+def test_typed_roundtrip(channel_type, message):
+    fmt = can_codec.struct_format(channel_type)
+    assert can_codec.decode(can_codec.encode_typed(fmt, message)) == message
+
+
+def test_typed_rejects_none():
+    with pytest.raises(Exception):
+        can_codec.encode_typed(can_codec.struct_format('float32'), None)
+
+
+def test_group_roundtrip():
+    fmts = [can_codec.struct_format(t) for t in ('float32', 'bool', 'struct:f', 'struct:ff')]
+    messages = [0.5, False, (1.0,), (2.0, 3.0)]
+    assert can_codec.decode(can_codec.encode_group(fmts, messages)) == messages
+
+
+def test_unknown_type():
+    with pytest.raises(ValueError):
+        can_codec.struct_format('float16')
+
+
+def test_topic_is_exact():
+    assert can_codec.channel_of(can_codec.topic('cam/image')) == 'cam/image'
+    assert not can_codec.topic('cam/image_out').startswith(can_codec.topic('cam/image'))
+
+
+def test_shared_roundtrip_and_overwrite():
+    ring = SharedFrameRing.create(ring_name('test_codec'), 64, 2)
+    try:
+        array = np.arange(64, dtype=np.uint8)
+        slot, seq = ring.write(array)
+        frames = can_codec.encode_shared(ring.name, slot, seq, array)
+        assert np.array_equal(can_codec.decode(frames, lambda name: ring), array)
+        ring.write(array)
+        ring.write(array)  # the slot again
+        with pytest.raises(LookupError):
+            can_codec.decode(frames, lambda name: ring)
+    finally:
+        ring.close(unlink=True)
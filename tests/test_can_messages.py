@@ -0,0 +1,66 @@
+# coding=utf-8
+import asyncio
+import threading
+import time
+from components.local_can import LocalCAN
+
+
+def _publish(can, channel, count, interval, published):
+    for i in range(count):
+        can.publish(channel, i)
+        published.append(i)
+        time.sleep(interval)
+
+
+def test_latest_channel_slow_consumer_gets_newest():
+    can = LocalCAN(channels={'cam/image': 'latest'})
+    received = []
+    published = []
+    lags = []
+
+    async def consume():
+        iteration = can.messages(['cam/image'])
+        first = asyncio.ensure_future(iteration.__anext__())
+        await asyncio.sleep(0.05)  # subscribed
+        publisher = threading.Thread(target=_publish, args=(can, 'cam/image', 40, 0.005, published))
+        publisher.start()
+        message = (await first)[1]
+        while True:
+            received.append(message)
+            if message == 39:
+                break
+            await asyncio.sleep(0.05)  # slow consumer
+            newest = published[-1]
+            message = (await iteration.__anext__())[1]
+            lags.append(newest - message)
+        await iteration.aclose()
+        publisher.join()
+
+    can.publish('cam/image', -1)  # before the iteration subscribes, not received
+    asyncio.run(asyncio.wait_for(consume(), 10))
+
+    assert received[-1] == 39
+    assert len(received) < 20  # the intermediate frames were overwritten, not queued
+    assert received == sorted(received)
+    assert max(lags) <= 0  # no stale message held while the consumer was busy
+    assert can.subscriber_counts().get('cam/image', 0) == 0
+
+
+def test_all_channel_keeps_every_message():
+    can = LocalCAN()
+    received = []
+
+    async def consume():
+        iteration = can.messages(['steering'])
+        first = asyncio.ensure_future(iteration.__anext__())
+        await asyncio.sleep(0.05)  # subscribed
+        for i in range(10):
+            can.publish('steering', i)
+        received.append((await first)[1])
+        async for _, message in iteration:
+            received.append(message)
+            if len(received) == 10:
+                break
+
+    asyncio.run(asyncio.wait_for(consume(), 10))
+    assert received == list(range(10))
@@ -0,0 +1,30 @@
+# coding=utf-8
+import glob
+import os
+import pytest
+import yaml
+from car import Car
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIGS = sorted(glob.glob(os.path.join(ROOT, 'config', '*.yml')))
+
+
+@pytest.mark.parametrize('config_file', CONFIGS, ids=os.path.basename)
+def test_car_builds_from_config(config_file, monkeypatch):
+    monkeypatch.chdir(ROOT)  # the components are found under src/components
+    try:
+        car = Car(config_file, 1)
+    except ModuleNotFoundError as e:  # hardware libraries of the car, not installed here
+        if e.name is None or os.path.exists(os.path.join(ROOT, 'src', e.name.split('.')[0])):
+            raise
+        pytest.skip('{} not installed'.format(e.name))
+    assert len(car.components) > 0
+
+
+@pytest.mark.parametrize('config_file', CONFIGS, ids=os.path.basename)
+def test_component_modules_parse(config_file, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    with open(config_file) as f:
+        components = yaml.load(f, Loader=yaml.FullLoader)['components']
+    for module in components:
+        assert len(Car._component_classes(str(module))) > 0, module
@@ -0,0 +1,73 @@
+# coding=utf-8
+import threading
+import numpy as np
+import pytest
+from utils.frame_ring import FrameRing
+
+
+def _write(ring, value, timestamp):
+    slot, frame = ring.acquire()
+    frame[:] = value
+    ring.commit(slot, timestamp)
+    return slot
+
+
+def test_latest_copies_the_newest_frame():
+    ring = FrameRing((4, 4))
+    assert ring.latest() is None
+    _write(ring, 1, 0.1)
+    _write(ring, 2, 0.2)
+    seq, timestamp, frame = ring.latest()
+    assert (seq, timestamp) == (2, 0.2)
+    assert np.all(frame == 2)
+    frame[:] = 0  # a copy
+    out = np.empty((4, 4), np.uint8)
+    assert ring.latest(out)[2] is out and np.all(out == 2)
+
+
+def test_slots_are_reused():
+    ring = FrameRing((4, 4), slots=3)
+    buffers = [id(frame) for frame in ring.frames]
+    slots = [_write(ring, i, i) for i in range(9)]
+    assert set(slots) <= {0, 1, 2}
+    assert all(a != b for a, b in zip(slots, slots[1:]))  # the newest frame is never written into
+    assert [id(frame) for frame in ring.frames] == buffers
+
+
+def test_slot_being_copied_is_not_reused():
+    ring = FrameRing((4, 4), slots=3)
+    _write(ring, 1, 0.1)
+    copied = ring._latest
+    ring._refs[copied] += 1  # a consumer is copying it
+    for i in range(5):
+        assert _write(ring, i, i) != copied
+    ring._refs[copied] -= 1
+
+
+def test_too_few_slots():
+    with pytest.raises(ValueError):
+        FrameRing((4, 4), slots=2)
+
+
+def test_concurrent_frames_are_whole():
+    ring = FrameRing((240, 320, 3))
+    stop = threading.Event()
+
+    def capture():
+        value = 0
+        while not stop.is_set():
+            value += 1
+            _write(ring, value % 256, value)
+
+    writer = threading.Thread(target=capture)
+    writer.start()
+    try:
+        out = np.empty((240, 320, 3), np.uint8)
+        for _ in range(500):
+            latest = ring.latest(out)
+            if latest is not None:
+                _, timestamp, frame = latest
+                assert np.all(frame == timestamp % 256)  # not overwritten while copied
+    finally:
+        stop.set()
+        writer.join()
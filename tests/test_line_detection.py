@@ -0,0 +1,47 @@
+# coding=utf-8
+import cv2
+import numpy as np
+import pytest
+from applications import line_detection
+
+
+def _slide_window_reference(binary, window_height=50, window_width=120, recenter_pixels=30):
+    """
+    The sliding window search testing every nonzero pixel against every window.
+    """
+    line_current = np.argmax(line_detection.base_hist(binary))
+    nonzeroy, nonzerox = binary.nonzero()
+    line_inds = []
+    for window in range(binary.shape[0] // window_height):
+        win_y_low = binary.shape[0] - (window + 1) * window_height
+        win_y_high = binary.shape[0] - window * window_height
+        good_inds = ((nonzeroy >= win_y_low) & (nonzeroy < win_y_high) &
+                     (nonzerox >= line_current - window_width // 2) &
+                     (nonzerox < line_current + window_width // 2)).nonzero()[0]
+        line_inds.append(good_inds)
+        if len(good_inds) > recenter_pixels:
+            line_current = int(np.mean(nonzerox[good_inds]))
+    line_inds = np.concatenate(line_inds)
+    return nonzerox[line_inds], nonzeroy[line_inds]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_slide_window_matches_reference(seed):
+    random = np.random.RandomState(seed)
+    binary = np.zeros((360, 640), np.uint8)
+    points = np.array([[random.randint(100, 540), y] for y in range(360, -1, -60)], np.int32)
+    cv2.polylines(binary, [points], False, 255, 12)
+    binary[random.rand(360, 640) < 0.01] = 255  # noise
+
+    linex, liney, _ = line_detection.slide_window_find(binary)
+    expected_x, expected_y = _slide_window_reference(binary)
+    assert np.array_equal(linex, expected_x) and np.array_equal(liney, expected_y)
+
+
+def test_line_base_near():
+    binary = np.zeros((100, 640), np.uint8)
+    binary[:, 300:304] = 255
+    binary[:, 500:520] = 255  # larger, but out of the band
+    base, pixels = line_detection.line_base_near(binary, 310, 40)
+    assert 300 <= base < 304 and pixels == 100
+    assert line_detection.line_base_near(binary, 100, 40)[1] == 0
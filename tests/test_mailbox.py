@@ -0,0 +1,83 @@
+# coding=utf-8
+import threading
+import pytest
+from utils.mailbox import Mailbox, parse_policy
+
+
+@pytest.mark.parametrize('policy, expected', [(None, None), ('all', None), ('latest', 1), ('queue(5)', 5),
+                                              ('queue( 2 )', 2)])
+def test_parse_policy(policy, expected):
+    assert parse_policy(policy) == expected
+
+
+@pytest.mark.parametrize('policy', ['queue(0)', 'newest', 'queue(x)'])
+def test_parse_policy_unknown(policy):
+    with pytest.raises(ValueError):
+        parse_policy(policy)
+
+
+def test_arrival_order_across_channels():
+    mailbox = Mailbox()
+    for i, channel in enumerate(['a', 'b', 'a', 'c']):
+        mailbox.put(channel, i)
+    assert [mailbox.get(timeout=0) for _ in range(4)] == [('a', 0), ('b', 1), ('a', 2), ('c', 3)]
+    assert mailbox.get(timeout=0) is None
+
+
+def test_latest_keeps_newest_and_counts_dropped():
+    mailbox = Mailbox({'img': 1})
+    for i in range(5):
+        mailbox.put('img', i)
+    assert mailbox.get(timeout=0) == ('img', 4)
+    assert mailbox.get(timeout=0) is None
+    assert mailbox.dropped['img'] == 4
+
+
+def test_queue_drops_oldest():
+    mailbox = Mailbox({'img': 2})
+    for i in range(4):
+        mailbox.put('img', i)
+    assert [mailbox.get(timeout=0)[1] for _ in range(2)] == [2, 3]
+    assert mailbox.dropped['img'] == 2
+
+
+def test_urgent_messages_first():
+    mailbox = Mailbox()
+    mailbox.put('img', 0)
+    mailbox.put('steering', 1, urgent=True)
+    mailbox.put('img', 2)
+    assert [mailbox.get(timeout=0) for _ in range(3)] == [('steering', 1), ('img', 0), ('img', 2)]
+
+
+def test_urgency_is_per_message():
+    mailbox = Mailbox()
+    mailbox.put('img', None, urgent=True)
+    assert mailbox.get(timeout=0) == ('img', None)
+    mailbox.put('img', 1)
+    mailbox.put('steering', 2)
+    assert mailbox.get(timeout=0) == ('img', 1)  # no longer urgent
+
+
+def test_put_many_is_atomic():
+    mailbox = Mailbox()
+    mailbox.put_many([('a', 1), ('b', 2)], urgent=True)
+    assert [mailbox.get(timeout=0) for _ in range(2)] == [('a', 1), ('b', 2)]
+
+
+def test_close_wakes_getter():
+    mailbox = Mailbox()
+    result = []
+    getter = threading.Thread(target=lambda: result.append(mailbox.get()))
+    getter.start()
+    mailbox.close()
+    getter.join(1)
+    assert not getter.is_alive() and result == [None]
+
+
+def test_notify():
+    calls = []
+    mailbox = Mailbox(notify=lambda: calls.append(1))
+    mailbox.put('a', 1)
+    mailbox.put_many([('a', 2), ('b', 3)])
+    mailbox.close()
+    assert len(calls) == 3
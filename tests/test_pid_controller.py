@@ -0,0 +1,59 @@
+# coding=utf-8
+import pytest
+from utils.pid_controller import PIDController
+
+
+def test_proportional_and_derivative():
+    controller = PIDController([-0.01, -0.02, 0.0])
+    assert controller.steer(20) == pytest.approx(-0.01 * 20 - 0.02 * 20)
+    assert controller.steer(30) == pytest.approx(-0.01 * 30 - 0.02 * 10)
+
+
+def test_nominal_dt_is_per_step():
+    per_step, timed = PIDController([-0.01, -0.02, -0.001]), PIDController([-0.01, -0.02, -0.001], 0.1)
+    for cte in (20, 30, 25):
+        assert timed.steer(cte, 0.1) == pytest.approx(per_step.steer(cte))
+
+
+def test_dt_scales_derivative_and_integral():
+    controller = PIDController([0.0, -0.01, 0.0], 0.1)
+    controller.steer(20, 0.1)
+    assert controller.steer(30, 0.05) == pytest.approx(-0.01 * 10 * 2)  # same change in half the time
+
+    controller = PIDController([0.0, 0.0, -0.001], 0.1)
+    controller.steer(20, 0.05)
+    assert controller.int_cte == pytest.approx(10)
+
+
+def test_no_dt_or_interval_is_per_step():
+    controller = PIDController([0.0, -0.01, 0.0])
+    controller.steer(20, 0.05)  # no nominal interval, dt ignored
+    assert controller.steer(30, 0.05) == pytest.approx(-0.1)
+
+
+def test_integral_reset_near_line():
+    controller = PIDController([0.0, 0.0, -0.001])
+    controller.steer(50)
+    controller.steer(50)
+    controller.steer(5)
+    assert controller.int_cte == 0
+
+
+def test_clamped():
+    controller = PIDController([-1.0, 0.0, 0.0])
+    assert controller.steer(100) == -1
+    assert controller.steer(-100) == 1
+
+
+def test_coefficients_referenced():
+    coeffs = [-0.01, 0.0, 0.0]
+    controller = PIDController(coeffs)
+    coeffs[0] = -0.02
+    assert controller.steer(10) == pytest.approx(-0.2)
+
+
+def test_reset():
+    controller = PIDController([-0.01, -0.01, -0.001])
+    controller.steer(50)
+    controller.reset()
+    assert controller.prev_cte == 0 and controller.int_cte == 0
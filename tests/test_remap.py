@@ -0,0 +1,77 @@
+# coding=utf-8
+import os
+import pickle
+import shutil
+import cv2
+import numpy as np
+import pytest
+from applications import cv_utils
+from components.pid import PIDLineFollower
+
+CALIBRATION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'config', 'calibration_result_640.pkl')
+SIZE = (640, 360)
+
+
+@pytest.fixture
+def calibration(tmp_path):
+    """
+    A copy of the calibration result, the remap tables are cached next to it.
+    """
+    path = str(tmp_path / 'calibration.pkl')
+    shutil.copyfile(CALIBRATION, path)
+    return path
+
+
+def _image():
+    v, u = np.mgrid[0:SIZE[1], 0:SIZE[0]]
+    image = np.dstack([u * 255 / (SIZE[0] - 1), v * 255 / (SIZE[1] - 1), (u + v) % 256]).astype(np.uint8)
+    return cv2.GaussianBlur(image, (0, 0), 3)
+
+
+def test_maps_match_undistort_and_transform():
+    with open(CALIBRATION, 'br') as f:
+        mtx, dist, corners, img_size = pickle.load(f)
+    image = _image()
+    reference = cv_utils.undistort_and_tansform(image, mtx, dist, corners, img_size)
+    map1, map2 = cv_utils.undistort_and_transform_maps(mtx, dist, corners, img_size, SIZE)
+    remapped = cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
+
+    assert remapped.shape == reference.shape
+    inside = (reference.sum(axis=2) > 0) & (remapped.sum(axis=2) > 0)
+    inside = cv2.erode(inside.astype(np.uint8), np.ones((5, 5), np.uint8)).astype(bool)  # away from the borders
+    assert inside.mean() > 0.9
+    diff = np.abs(remapped.astype(int) - reference.astype(int))[inside]
+    assert np.percentile(diff, 99) <= 2
+
+
+def test_maps_are_cached(calibration):
+    map1, map2 = cv_utils.load_undistort_and_transform_maps(calibration, SIZE)
+    cache = calibration.replace('.pkl', '_remap_640x360_640x360.npz')
+    assert os.path.exists(cache)
+    cached1, cached2 = cv_utils.load_undistort_and_transform_maps(calibration, SIZE)
+    assert np.array_equal(cached1, map1) and np.array_equal(cached2, map2)
+
+
+def test_cache_rebuilt_on_new_calibration(calibration):
+    cv_utils.load_undistort_and_transform_maps(calibration, SIZE)
+    with open(calibration, 'br') as f:
+        mtx, dist, corners, img_size = pickle.load(f)
+    with open(calibration, 'bw') as f:
+        pickle.dump((mtx, dist * 0, corners, img_size), f)  # no lens distortion
+    map1, map2 = cv_utils.load_undistort_and_transform_maps(calibration, SIZE)
+    expected1, expected2 = cv_utils.undistort_and_transform_maps(mtx, dist * 0, corners, img_size, SIZE)
+    assert np.array_equal(map1, expected1) and np.array_equal(map2, expected2)
+
+
+def test_pid_warps_the_roi_only(calibration, tmp_path):
+    roi = ((100, 210), (540, 310))
+    pid = PIDLineFollower(calibration, roi, pid_params_file=str(tmp_path / 'coefficients.pkl'))
+    image = _image()
+    binary = pid._preprocess_image(image)
+    assert pid.remap_tables[0].shape[:2] == (100, 440)
+
+    map1, map2 = cv_utils.load_undistort_and_transform_maps(calibration, SIZE)
+    full = cv2.cvtColor(cv2.remap(image, map1, map2, cv2.INTER_LINEAR), cv2.COLOR_BGR2GRAY)
+    _, expected = cv2.threshold(full[210:310, 100:540], pid.white_threshold, 255, cv2.THRESH_BINARY_INV)
+    assert np.array_equal(binary, expected)
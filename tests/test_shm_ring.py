@@ -0,0 +1,54 @@
+# coding=utf-8
+import os
+import numpy as np
+import pytest
+from utils.shm_ring import SharedFrameRing, ring_name, SHM_DIR
+
+
+@pytest.fixture
+def rings():
+    writer = SharedFrameRing.create(ring_name('test_ring'), 100, 3)
+    reader = SharedFrameRing.attach(writer.name)
+    yield writer, reader
+    reader.close()
+    writer.close(unlink=True)
+
+
+def test_read_copies_the_frame(rings):
+    writer, reader = rings
+    array = np.arange(100, dtype=np.uint8)
+    slot, seq = writer.write(array)
+    frame = reader.read(slot, seq, np.uint8, (100,))
+    assert np.array_equal(frame, array)
+    for _ in range(3):  # the slot is reused
+        writer.write(np.zeros(100, dtype=np.uint8))
+    assert np.array_equal(frame, array)  # the reader's copy is intact
+
+
+def test_overwritten_slot_is_dropped(rings):
+    writer, reader = rings
+    slot, seq = writer.write(np.ones(100, dtype=np.uint8))
+    for _ in range(3):
+        writer.write(np.zeros(100, dtype=np.uint8))
+    assert reader.read(slot, seq, np.uint8, (100,)) is None
+
+
+def test_slot_being_written_is_dropped(rings):
+    writer, reader = rings
+    slot, seq = writer.write(np.ones(100, dtype=np.uint8))
+    writer._seqs[slot] = 0  # as while the writer copies into the slot
+    assert reader.read(slot, seq, np.uint8, (100,)) is None
+
+
+def test_frame_too_large(rings):
+    writer, _ = rings
+    with pytest.raises(ValueError):
+        writer.write(np.zeros(1000, dtype=np.uint8))
+
+
+def test_unlink():
+    ring = SharedFrameRing.create(ring_name('test_unlink'), 64, 2)
+    path = ring.path
+    ring.close(unlink=True)
+    assert not os.path.exists(path)
+    assert os.path.dirname(path) == SHM_DIR